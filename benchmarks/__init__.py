@@ -0,0 +1,10 @@
+"""
+Benchmarks for the render, validation and model loading hot paths.
+
+Run them from the repository root::
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --compare results.json
+
+See ``python -m benchmarks --help`` for all options.
+"""
@@ -0,0 +1,255 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess  # nosec
+import sys
+import time
+
+import django
+
+# The benchmarks delete MEDIA_ROOT and migrate the database. Never pick up
+# an exported project settings module.
+os.environ['DJANGO_SETTINGS_MODULE'] = 'tests.settings'
+django.setup()
+
+import PIL  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.core.files.base import ContentFile, File  # noqa: E402
+from django.core.files.storage import default_storage  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from PIL import Image, features  # noqa: E402
+
+from stdimage.models import StdImageField, StdImageFieldFile  # noqa: E402
+from stdimage.validators import MaxSizeValidator, MinSizeValidator  # noqa: E402
+from tests.models import ThumbnailModel  # noqa: E402
+
+FORMATS = {
+    'jpeg': ('JPEG', 'RGB', (1024, 768), {'quality': 90}),
+    'png': ('PNG', 'RGBA', (1024, 768), {}),
+    'webp': ('WEBP', 'RGB', (1024, 768), {'quality': 90}),
+    'tiff': ('TIFF', 'RGB', (6000, 4000), {}),
+}
+
+SIZES = {
+    'thumbnail': (100, 75),
+    'large': (800, 800),
+}
+
+_benchmarks = []
+
+
+def benchmark(name, number=1):
+    """Register a benchmark, the decorated function returns the timed callable."""
+    def decorator(setup):
+        _benchmarks.append((name, number, setup))
+        return setup
+    return decorator
+
+
+def make_image(fmt):
+    """Return the encoded bytes of a synthetic image in the given format."""
+    pil_format, mode, size, options = FORMATS[fmt]
+    img = Image.merge('RGB', [
+        Image.linear_gradient('L').resize(size),
+        Image.radial_gradient('L').resize(size),
+        Image.effect_noise(size, 64),
+    ]).convert(mode)
+    with io.BytesIO() as f:
+        img.save(f, pil_format, **options)
+        return f.getvalue()
+
+
+def save_fixture(fmt):
+    name = 'benchmarks/source.%s' % fmt
+    default_storage.delete(name)
+    return default_storage.save(name, ContentFile(make_image(fmt)))
+
+
+def get_variations(sizes):
+    field = StdImageField(variations={
+        name: size for name, size in sizes.items()
+    })
+    return field.variations
+
+
+def register_benchmarks():
+    available = [
+        fmt for fmt in FORMATS
+        if fmt != 'webp' or features.check('webp')
+    ]
+
+    for fmt in available:
+        for size_name, size in SIZES.items():
+            def render_variation(fmt=fmt, size_name=size_name, size=size):
+                file_name = save_fixture(fmt)
+                variation = get_variations({size_name: size})[size_name]
+                return lambda: StdImageFieldFile.render_variation(
+                    file_name, variation, replace=True, storage=default_storage,
+                )
+            benchmark(
+                'render_variation[%s-%s]' % (fmt, size_name)
+            )(render_variation)
+
+    for count in (1, 4, 8):
+        def render_variations(count=count):
+            file_name = save_fixture('jpeg')
+            variations = get_variations({
+                'v%d' % i: (100 + 100 * i, 100 + 100 * i) for i in range(count)
+            })
+            return lambda: StdImageFieldFile.render_all_variations(
+                file_name, variations, replace=True, storage=default_storage,
+            )
+        benchmark('render_variations[jpeg-%d]' % count)(render_variations)
+
+    @benchmark('render_variations[tiff-crops]')
+    def render_crops():
+        file_name = save_fixture('tiff')
+        field = StdImageField(variations={
+            'square_%d' % i: (i, i, True) for i in (64, 128, 256, 512)
+        })
+        return lambda: StdImageFieldFile.render_all_variations(
+            file_name, field.variations, replace=True, storage=default_storage,
+        )
+
+    for fmt in available:
+        for validator_class in (MinSizeValidator, MaxSizeValidator):
+            def validate(fmt=fmt, validator_class=validator_class):
+                content = make_image(fmt)
+                limit = 1 if validator_class is MinSizeValidator else 100000
+                validator = validator_class(limit, limit)
+                return lambda: validator(File(io.BytesIO(content), 'image'))
+            benchmark(
+                '%s[%s]' % (validator_class.__name__, fmt), number=100
+            )(validate)
+
+    def create_rows(count):
+        ThumbnailModel.objects.all().delete()
+        ThumbnailModel.objects.bulk_create(
+            ThumbnailModel(image='benchmarks/row_%d.jpg' % i) for i in range(count)
+        )
+
+    @benchmark('model_load[10000]')
+    def model_load():
+        create_rows(10000)
+        return lambda: list(ThumbnailModel.objects.all())
+
+    @benchmark('model_load_variation_url[10000]')
+    def model_load_variation_url():
+        create_rows(10000)
+        return lambda: [
+            obj.image.thumbnail.url for obj in ThumbnailModel.objects.all()
+        ]
+
+    for pipeline in (False, True):
+        def rendervariations(pipeline=pipeline):
+            ThumbnailModel.objects.all().delete()
+            content = make_image('jpeg')
+            for _ in range(50):
+                ThumbnailModel.objects.create(image=ContentFile(content, 'image.jpg'))
+
+            def run():
+                with contextlib.redirect_stderr(io.StringIO()):
+                    call_command('rendervariations', 'tests.ThumbnailModel.image',
+                                 replace=True, pipeline=pipeline)
+            return run
+        benchmark('rendervariations[jpeg-50%s]' % ('-pipeline' if pipeline else ''))(
+            rendervariations
+        )
+
+
+def measure(fn, number, repeat):
+    """Return per call timings of ``repeat`` rounds of ``number`` calls."""
+    fn()  # warm up caches and lazy imports
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - start) / number)
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'stdev': statistics.stdev(timings) if len(timings) > 1 else 0,
+        'number': number,
+        'repeat': repeat,
+    }
+
+
+def get_metadata():
+    try:
+        commit = subprocess.check_output(  # nosec
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+    }
+
+
+def compare(results, baseline):
+    """Print the median of each benchmark relative to a baseline."""
+    print('%-45s %12s %12s %8s' % ('benchmark', 'baseline', 'current', 'ratio'))
+    for name, result in results.items():
+        try:
+            before = baseline['results'][name]['median']
+        except KeyError:
+            continue
+        print('%-45s %10.2fms %10.2fms %7.2fx' % (
+            name, before * 1000, result['median'] * 1000,
+            result['median'] / before,
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Benchmark the render, validation and model loading paths.',
+    )
+    parser.add_argument('-k', '--filter', default='',
+                        help='Only run benchmarks whose name contains FILTER.')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of timed rounds per benchmark. Default: 5')
+    parser.add_argument('-o', '--output',
+                        help='Write the results as JSON to OUTPUT.')
+    parser.add_argument('-c', '--compare',
+                        help='Compare the results with a previous JSON output.')
+    options = parser.parse_args(argv)
+
+    logging.disable(logging.WARNING)
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    register_benchmarks()
+    results = {}
+    try:
+        for name, number, setup in _benchmarks:
+            if options.filter not in name:
+                continue
+            results[name] = measure(setup(), number, options.repeat)
+            print('%-45s %10.2fms' % (name, results[name]['median'] * 1000),
+                  file=sys.stderr)
+    finally:
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({'meta': get_metadata(), 'results': results}, f, indent=2)
+    if options.compare:
+        with open(options.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
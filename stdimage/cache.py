@@ -0,0 +1,302 @@
+"""
+Content addressed cache of rendered variations.
+
+Variations are cached by the digest of the source image and the
+specification of the variation. Rendering the same upload again restores
+the encoded variations from the cache, without decoding the source.
+
+Source images can be cached, too. Jobs that render one variation of the
+same image at a time fetch the source from the storage only once.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from .files import get_private_dir
+from .manifest import get_spec_hash
+
+__all__ = (
+    'RenderCache', 'LocalRenderCache', 'LocalSourceCache', 'DjangoRenderCache',
+    'get_render_cache', 'get_source_cache', 'get_cache_key', 'get_source_key',
+    'get_digest',
+)
+
+_render_caches = {}
+_render_caches_lock = threading.Lock()
+
+
+def get_digest(content):
+    """Return the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_cache_key(source_digest, field_class, variation, extension=None):
+    """Return the cache key of a variation, or one of its siblings."""
+    key = ':'.join((
+        source_digest,
+        '%s.%s' % (field_class.__module__, field_class.__qualname__),
+        get_spec_hash(variation),
+        extension or '',
+    ))
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_source_key(storage, file_name):
+    """Return the cache key of a source image, by its storage and name."""
+    try:
+        path, args, kwargs = storage.deconstruct()
+    except AttributeError:
+        path, args, kwargs = '%s.%s' % (
+            type(storage).__module__, type(storage).__qualname__
+        ), (), {}
+    key = json.dumps([path, args, kwargs, file_name], default=str, sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class RenderCache:
+    """Base class of render caches, that map keys to encoded variations."""
+
+    def get(self, key):
+        """Return the cached bytes of a key, or ``None``."""
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        """Return a dict of the cached bytes of all keys that were found."""
+        found = {}
+        for key in keys:
+            content = self.get(key)
+            if content is not None:
+                found[key] = content
+        return found
+
+    def set(self, key, content):
+        """Store the bytes of a key."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Remove a key, if it is cached."""
+        raise NotImplementedError
+
+
+class LocalRenderCache(RenderCache):
+    """
+    Render cache in a local directory, that evicts the least recently used files.
+
+    Every process keeps an index of the cached files. Files added by other
+    processes sharing the directory are picked up by rescanning it, once the
+    index is older than ``scan_interval`` seconds. The total size may
+    therefore exceed ``max_size`` in between scans.
+
+    Args:
+        path (str):
+            Cache directory. Defaults to the ``STDIMAGE_RENDER_CACHE_DIR``
+            setting, or a directory in the system's temporary directory
+            that is only accessible by the current user.
+        max_size (int):
+            Total bytes of all cached files. Defaults to the
+            ``STDIMAGE_RENDER_CACHE_MAX_SIZE`` setting, or 256 MiB.
+
+    """
+
+    scan_interval = 60
+
+    def __init__(self, path=None, max_size=None):
+        self.path = path or getattr(settings, 'STDIMAGE_RENDER_CACHE_DIR', None) \
+            or get_private_dir('stdimage-cache')
+        self.max_size = max_size or getattr(
+            settings, 'STDIMAGE_RENDER_CACHE_MAX_SIZE', 256 * 1024 * 1024
+        )
+        self._index = None
+        self._total = 0
+        self._scanned = 0
+        self._lock = threading.Lock()
+
+    def _load_index(self, rescan=False):
+        if self._index is not None and not rescan:
+            return self._index
+        os.makedirs(self.path, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.tmp'):
+                continue
+            try:
+                if entry.is_file():
+                    entries.append((entry.name, entry.stat()))
+            except FileNotFoundError:
+                pass  # evicted by another process
+        entries.sort(key=lambda e: e[1].st_mtime)
+        self._index = OrderedDict(
+            (name, entry_stat.st_size) for name, entry_stat in entries
+        )
+        self._total = sum(self._index.values())
+        self._scanned = time.monotonic()
+        return self._index
+
+    def get(self, key):
+        path = os.path.join(self.path, key)
+        with self._lock:
+            index = self._load_index()
+            try:
+                with open(path, 'rb') as f:
+                    content = f.read()
+                os.utime(path)
+            except FileNotFoundError:
+                self._total -= index.pop(key, 0)
+                return None
+            index[key] = len(content)
+            index.move_to_end(key)
+        return content
+
+    def set(self, key, content):
+        path = os.path.join(self.path, key)
+        with self._lock:
+            index = self._load_index()
+            tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+            self._total += len(content) - index.pop(key, 0)
+            index[key] = len(content)
+            if time.monotonic() - self._scanned > self.scan_interval:
+                index = self._load_index(rescan=True)
+            while self._total > self.max_size and len(index) > 1:
+                old_key, size = index.popitem(last=False)
+                self._total -= size
+                try:
+                    os.remove(os.path.join(self.path, old_key))
+                except FileNotFoundError:
+                    pass
+
+    def delete(self, key):
+        with self._lock:
+            index = self._load_index()
+            self._total -= index.pop(key, 0)
+            try:
+                os.remove(os.path.join(self.path, key))
+            except FileNotFoundError:
+                pass
+
+
+class LocalSourceCache(LocalRenderCache):
+    """
+    Cache of source images in a local directory, see :func:`get_source_cache`.
+
+    Args:
+        path (str):
+            Cache directory. Defaults to the ``STDIMAGE_SOURCE_CACHE_DIR``
+            setting, or a directory in the system's temporary directory
+            that is only accessible by the current user.
+        max_size (int):
+            Total bytes of all cached files. Defaults to the
+            ``STDIMAGE_SOURCE_CACHE_MAX_SIZE`` setting, or 1 GiB.
+
+    """
+
+    def __init__(self, path=None, max_size=None):
+        super().__init__(
+            path or getattr(settings, 'STDIMAGE_SOURCE_CACHE_DIR', None)
+            or get_private_dir('stdimage-sources'),
+            max_size or getattr(
+                settings, 'STDIMAGE_SOURCE_CACHE_MAX_SIZE', 1024 * 1024 * 1024
+            ),
+        )
+
+
+class DjangoRenderCache(RenderCache):
+    """
+    Render cache backed by a Django cache, e.g. Redis or Memcached.
+
+    Args:
+        alias (str):
+            Alias of the cache in the ``CACHES`` setting. Defaults to the
+            ``STDIMAGE_RENDER_CACHE_ALIAS`` setting, or ``"default"``.
+        timeout (int):
+            Seconds until an entry expires, defaults to the cache's timeout.
+
+    """
+
+    key_prefix = 'stdimage:'
+
+    def __init__(self, alias=None, timeout=None):
+        self.alias = alias or getattr(
+            settings, 'STDIMAGE_RENDER_CACHE_ALIAS', 'default'
+        )
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(self.key_prefix + key)
+
+    def get_many(self, keys):
+        found = self.cache.get_many([self.key_prefix + key for key in keys])
+        return {key[len(self.key_prefix):]: value for key, value in found.items()}
+
+    def set(self, key, content):
+        kwargs = {} if self.timeout is None else {'timeout': self.timeout}
+        self.cache.set(self.key_prefix + key, content, **kwargs)
+
+    def delete(self, key):
+        self.cache.delete(self.key_prefix + key)
+
+
+def get_render_cache(cache=None):
+    """
+    Return the render cache instance, or ``None`` if caching is disabled.
+
+    Args:
+        cache (str, RenderCache):
+            A cache instance or the import path of a cache class.
+            Defaults to the ``STDIMAGE_RENDER_CACHE`` setting, which
+            defaults to ``None``. Instances created from an import path
+            are shared within a process.
+
+    """
+    if cache is None:
+        cache = getattr(settings, 'STDIMAGE_RENDER_CACHE', None)
+    return _get_cache(cache)
+
+
+def get_source_cache(cache=None):
+    """
+    Return the source cache instance, or ``None`` if caching is disabled.
+
+    Source images are read from the cache before they are fetched from the
+    storage, see :meth:`stdimage.models.StdImageFieldFile.open_image`.
+    Entries are keyed by storage and file name, and removed once the image
+    is saved or deleted through its field. Images replaced by other means
+    under the same name are served from the cache until they are evicted.
+
+    Args:
+        cache (str, RenderCache):
+            A cache instance or the import path of a cache class, e.g.
+            ``"stdimage.cache.LocalSourceCache"``. Defaults to the
+            ``STDIMAGE_SOURCE_CACHE`` setting, which defaults to ``None``.
+            Instances created from an import path are shared within a process.
+
+    """
+    if cache is None:
+        cache = getattr(settings, 'STDIMAGE_SOURCE_CACHE', None)
+    return _get_cache(cache)
+
+
+def _get_cache(cache):
+    if not isinstance(cache, str):
+        return cache
+    with _render_caches_lock:
+        try:
+            return _render_caches[cache]
+        except KeyError:
+            return _render_caches.setdefault(cache, import_string(cache)())
@@ -0,0 +1,68 @@
+"""Executors used to render variations concurrently."""
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+
+from .queue import RenderQueue, get_queue
+
+__all__ = ('InlineExecutor', 'get_executor')
+
+EXECUTOR_CLASSES = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor,
+}
+
+_executors = {}
+
+
+class InlineExecutor(Executor):
+    """Executor that runs every task immediately in the calling thread."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        return future
+
+
+def get_executor(executor=None):
+    """
+    Return an executor instance for the given executor option.
+
+    Args:
+        executor (str, concurrent.futures.Executor, stdimage.queue.RenderQueue):
+            Either ``"inline"``, ``"thread"``, ``"process"``, ``"queue"``,
+            an executor or a render queue instance. Defaults to the
+            ``STDIMAGE_RENDER_EXECUTOR`` setting, which defaults to ``"inline"``.
+
+    Thread and process pools are created once per process and are shared
+    between all fields. Their size can be set using the
+    ``STDIMAGE_RENDER_WORKERS`` setting.
+
+    ``"queue"`` returns the render queue configured in the
+    ``STDIMAGE_RENDER_QUEUE`` setting, see :func:`stdimage.queue.get_queue`.
+
+    """
+    if executor is None:
+        executor = getattr(settings, 'STDIMAGE_RENDER_EXECUTOR', 'inline')
+    if isinstance(executor, (Executor, RenderQueue)):
+        return executor
+    if executor == 'inline':
+        return InlineExecutor()
+    if executor == 'queue':
+        return get_queue()
+    try:
+        executor_class = EXECUTOR_CLASSES[executor]
+    except KeyError:
+        msg = ('"executor" expects one of "inline", "thread", "process", "queue",'
+               ' an Executor or RenderQueue instance, but got %r') % executor
+        raise ValueError(msg)
+    try:
+        return _executors[executor]
+    except KeyError:
+        workers = getattr(settings, 'STDIMAGE_RENDER_WORKERS', None)
+        return _executors.setdefault(executor, executor_class(workers))
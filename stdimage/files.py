@@ -0,0 +1,31 @@
+"""Local files shared by queues, caches and management commands."""
+import os
+import stat
+import tempfile
+
+from django.core.exceptions import ImproperlyConfigured
+
+__all__ = ('get_private_dir',)
+
+
+def get_private_dir(name):
+    """
+    Return a directory in the system's temporary directory for the current user.
+
+    The directory is created with access for its owner only. A directory
+    that exists already, but is owned or accessible by other users, is
+    rejected, since they could place files in it.
+    """
+    if hasattr(os, 'getuid'):
+        name = '%s-%d' % (name, os.getuid())
+    path = os.path.join(tempfile.gettempdir(), name)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if hasattr(os, 'getuid'):
+        path_stat = os.lstat(path)
+        if not stat.S_ISDIR(path_stat.st_mode) \
+                or path_stat.st_uid != os.getuid() \
+                or path_stat.st_mode & 0o077:
+            msg = ('"%s" must be a directory only accessible by its owner,'
+                   ' or configure a different directory in the settings') % path
+            raise ImproperlyConfigured(msg)
+    return path
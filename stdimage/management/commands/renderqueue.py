@@ -0,0 +1,34 @@
+from django.core.management import BaseCommand
+
+from stdimage.queue import FileRenderQueue, get_queue
+
+
+class Command(BaseCommand):
+    help = 'Renders variations deferred to the render queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst',
+                            action='store_true',
+                            dest='burst',
+                            default=False,
+                            help='Exit once the queue has no due jobs left.')
+        parser.add_argument('--interval',
+                            type=float,
+                            dest='interval',
+                            default=1,
+                            help='Seconds to wait between polls. Default: 1')
+        parser.add_argument('--path',
+                            type=str,
+                            dest='path',
+                            default=None,
+                            help='Directory of a file based render queue. '
+                                 'Defaults to the STDIMAGE_QUEUE_DIR setting.')
+
+    def handle(self, *args, **options):
+        path = options.get('path')
+        queue = FileRenderQueue(path) if path else get_queue()
+        processed = queue.work(
+            burst=options.get('burst', False),
+            interval=options.get('interval', 1),
+        )
+        self.stdout.write('%d jobs processed.' % processed)
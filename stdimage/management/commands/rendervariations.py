@@ -1,9 +1,21 @@
+import functools
+import hashlib
+import json
+import os
+from concurrent import futures
+from contextlib import ExitStack
+
+import django
 import progressbar
 from django.apps import apps
-from django.core.files.storage import get_storage_class
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.core.management import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
 
-from stdimage.utils import render_variations
+from stdimage.files import get_private_dir
+from stdimage.metrics import RenderStats
+from stdimage.utils import render_variations_bulk
 
 
 class Command(BaseCommand):
@@ -27,11 +39,98 @@ class Command(BaseCommand):
                             default=False,
                             help='Ignore missing source file error and '
                                  'skip render for that file')
+        parser.add_argument('-w', '--workers',
+                            type=int,
+                            dest='workers',
+                            default=1,
+                            help='Number of worker processes used to render '
+                                 'images in parallel. Default: 1')
+        parser.add_argument('--chunk-size',
+                            type=int,
+                            dest='chunk_size',
+                            default=10,
+                            help='Number of images queued per worker '
+                                 'process. Default: 10')
+        parser.add_argument('--batch-size',
+                            type=int,
+                            dest='batch_size',
+                            default=1000,
+                            help='Number of rows fetched from the database '
+                                 'at once. Default: 1000')
+        parser.add_argument('--resume',
+                            action='store_true',
+                            dest='resume',
+                            default=False,
+                            help='Continue after the last checkpoint of a '
+                                 'previous run.')
+        parser.add_argument('--checkpoint',
+                            dest='checkpoint',
+                            default=None,
+                            help='Checkpoint file, that records the last '
+                                 'processed primary key of each field. '
+                                 'Defaults to a file per settings module and '
+                                 'database with --resume.')
+        parser.add_argument('--pk-range',
+                            dest='pk_range',
+                            default=None,
+                            help='Only render objects with a primary key in '
+                                 'the range START:END, including START but '
+                                 'excluding END. Either bound may be omitted.')
+        parser.add_argument('--pipeline',
+                            action='store_true',
+                            dest='pipeline',
+                            default=False,
+                            help='Download, render and upload images in '
+                                 'concurrent stages. Workers are threads.')
+        parser.add_argument('--fetch-workers',
+                            type=int,
+                            dest='fetch_workers',
+                            default=4,
+                            help='Number of concurrent downloads of the '
+                                 'pipeline. Default: 4')
+        parser.add_argument('--store-workers',
+                            type=int,
+                            dest='store_workers',
+                            default=4,
+                            help='Number of concurrent uploads of the '
+                                 'pipeline. Default: 4')
+        parser.add_argument('--stats',
+                            action='store_true',
+                            dest='stats',
+                            default=False,
+                            help='Print a summary of the time spent per '
+                                 'render stage.')
 
     def handle(self, *args, **options):
         replace = options.get('replace', False)
         ignore_missing = options.get('ignore_missing', False)
+        workers = options.get('workers', 1)
+        chunk_size = options.get('chunk_size', 10)
+        batch_size = options.get('batch_size', 1000)
+        if workers < 1 or chunk_size < 1 or batch_size < 1:
+            raise CommandError(
+                '"workers", "chunk-size" and "batch-size" must be positive.'
+            )
+        pipeline = None
+        if options.get('pipeline', False):
+            pipeline = {
+                'fetch_workers': options.get('fetch_workers', 4),
+                'render_workers': workers,
+                'store_workers': options.get('store_workers', 4),
+            }
+            if min(pipeline.values()) < 1:
+                raise CommandError(
+                    '"fetch-workers" and "store-workers" must be positive.'
+                )
+        pk_range = options.get('pk_range')
+        checkpoint = None
+        if options.get('checkpoint') or options.get('resume', False):
+            checkpoint = Checkpoint(
+                options.get('checkpoint') or self.get_default_checkpoint()
+            )
+        stats = RenderStats() if options.get('stats', False) else None
         routes = options.get('field_path', [])
+        completed = []
         for route in routes:
             try:
                 app_label, model_name, field_name = route.rsplit('.')
@@ -45,53 +144,179 @@ class Command(BaseCommand):
             queryset = model_class._default_manager \
                 .exclude(**{'%s__isnull' % field_name: True}) \
                 .exclude(**{field_name: ''})
-            obj = queryset.first()
-            do_render = True
-            if obj:
-                f = getattr(obj, field_name)
-                do_render = f.field.render_variations
-            images = queryset.values_list(field_name, flat=True).iterator()
+            if pk_range:
+                queryset = queryset.filter(**self.parse_pk_range(
+                    pk_range, model_class._meta.pk
+                ))
+                route = '%s[%s]' % (route, pk_range)
+            if options.get('resume', False):
+                last_pk = checkpoint.get(route)
+                if last_pk is Checkpoint.DONE:
+                    completed.append(route)
+                    continue
+                if last_pk is not None:
+                    queryset = queryset.filter(pk__gt=last_pk)
             count = queryset.count()
+            batches = self.get_batches(queryset, field_name, batch_size)
 
-            self.render(field, images, count, replace, ignore_missing,
-                        do_render)
+            on_batch = None
+            if checkpoint is not None:
+                on_batch = functools.partial(checkpoint.set, route)
+            self.render(field, batches, count, replace, ignore_missing,
+                        workers, chunk_size, on_batch=on_batch,
+                        stats=stats, pipeline=pipeline)
+            if checkpoint is not None:
+                checkpoint.set(route, Checkpoint.DONE)
+            completed.append(route)
+        if checkpoint is not None:
+            checkpoint.clear(completed)
+        if stats is not None:
+            self.stdout.write(stats.format_summary())
 
     @staticmethod
-    def render(field, images, count, replace, ignore_missing, do_render):
-        kwargs_list = (
-            dict(
-                file_name=file_name,
-                do_render=do_render,
-                variations=field.variations,
-                replace=replace,
-                storage=field.storage.deconstruct()[0],
-                field_class=field.attr_class,
-                ignore_missing=ignore_missing,
-            )
-            for file_name in images
+    def get_default_checkpoint():
+        """
+        Return the checkpoint file of the current project and database.
+
+        The file is stored in a private directory of the current user, named
+        after the settings module and the name of the default database, so
+        that projects sharing a host do not resume each other's runs.
+        """
+        project = '%s:%s' % (
+            settings.SETTINGS_MODULE,
+            connections[DEFAULT_DB_ALIAS].settings_dict['NAME'],
         )
+        return os.path.join(
+            get_private_dir('stdimage-rendervariations'),
+            '%s.json' % hashlib.sha1(project.encode()).hexdigest(),  # nosec
+        )
+
+    @staticmethod
+    def parse_pk_range(pk_range, pk_field):
+        """Return queryset filters for a ``START:END`` primary key range."""
+        try:
+            start, end = pk_range.split(':')
+            lookups = {}
+            if start:
+                lookups['pk__gte'] = pk_field.to_python(start)
+            if end:
+                lookups['pk__lt'] = pk_field.to_python(end)
+        except (ValueError, ValidationError):
+            raise CommandError("Error parsing pk-range '{}'. Use format "
+                               "START:END.".format(pk_range))
+        return lookups
+
+    @staticmethod
+    def get_batches(queryset, field_name, batch_size):
+        """
+        Yield lists of ``(pk, file_name)`` tuples in primary key order.
+
+        Batches are fetched using keyset pagination, which is stable
+        while rows are added and does not slow down towards the end
+        of large tables, unlike offsets.
+        """
+        queryset = queryset.order_by('pk').values_list('pk', field_name)
+        batch = list(queryset[:batch_size])
+        while batch:
+            yield batch
+            batch = list(queryset.filter(pk__gt=batch[-1][0])[:batch_size])
+
+    @staticmethod
+    def render(field, batches, count, replace, ignore_missing, workers=1,
+               chunk_size=10, on_batch=None, stats=None, pipeline=None):
+        """
+        Render the variations of all images and report each finished batch.
+
+        Args:
+            batches: Iterable of lists of ``(pk, file_name)`` tuples.
+            on_batch (callable):
+                Called with the last primary key of each batch,
+                once all images of the batch have been rendered.
+            stats (stdimage.metrics.RenderStats):
+                Collects the render stages of all images, including
+                those rendered by worker processes.
+            pipeline (dict):
+                Keyword arguments of a :class:`stdimage.pipeline.RenderPipeline`,
+                that renders the images instead of a process pool.
+
+        """
         with progressbar.ProgressBar(max_value=count, widgets=(
             progressbar.RotatingMarker(),
             ' | ', progressbar.AdaptiveETA(),
             ' | ', progressbar.Percentage(),
             ' ', progressbar.Bar(),
-        )) as bar:
-            for _ in map(render_field_variations, kwargs_list):
-                bar += 1
-
-
-def render_field_variations(kwargs):
-    kwargs['storage'] = get_storage_class(kwargs['storage'])()
-    ignore_missing = kwargs.pop('ignore_missing')
-    do_render = kwargs.pop('do_render')
-    try:
-        if callable(do_render):
-            kwargs.pop('field_class')
-            do_render = do_render(**kwargs)
-        if do_render:
-            render_variations(**kwargs)
-    except FileNotFoundError as e:
-        if not ignore_missing:
-            raise CommandError(
-                 'Source file was not found, terminating. '
-                 'Use -i/--ignore-missing to skip this error.') from e
+        )) as bar, ExitStack() as stack:
+            def on_result(result):
+                if isinstance(result.error, FileNotFoundError):
+                    if not ignore_missing:
+                        raise CommandError(
+                            'Source file was not found, terminating. '
+                            'Use -i/--ignore-missing to skip this error.'
+                        ) from result.error
+                elif result.error is not None:
+                    raise result.error
+                bar.increment()
+
+            executor = 'inline'
+            if workers > 1 and not pipeline:
+                executor = stack.enter_context(futures.ProcessPoolExecutor(
+                    workers, initializer=django.setup
+                ))
+            for batch in batches:
+                render_variations_bulk(
+                    [file_name for _, file_name in batch], field, replace,
+                    executor=executor, max_pending=workers * chunk_size,
+                    stats=stats, on_result=on_result, pipeline=pipeline,
+                )
+                if on_batch is not None:
+                    on_batch(batch[-1][0])
+
+
+class Checkpoint:
+    """
+    JSON file that stores the last processed primary key by field route.
+
+    Routes that were rendered completely are marked as :attr:`DONE`, until
+    all routes of the command are rendered and the routes are cleared.
+    """
+
+    DONE = True
+
+    def __init__(self, path):
+        self.path = path
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, route):
+        return self._read().get(route)
+
+    def set(self, route, pk):
+        """Record the last processed primary key, or remove it if ``None``."""
+        checkpoints = self._read()
+        if pk is None:
+            if route not in checkpoints:
+                return
+            del checkpoints[route]
+        else:
+            checkpoints[route] = pk
+        self._write(checkpoints)
+
+    def clear(self, routes):
+        """Remove the checkpoints of all routes."""
+        checkpoints = self._read()
+        if not any(route in checkpoints for route in routes):
+            return
+        for route in routes:
+            checkpoints.pop(route, None)
+        self._write(checkpoints)
+
+    def _write(self, checkpoints):
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoints, f, default=str)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,60 @@
+"""
+Manifests of rendered variations.
+
+A manifest is a small JSON file stored next to the original image.
+It records the dimensions, byte size and specification hash of every
+rendered variation, so that no storage probe is needed to know whether
+a variation exists.
+
+Manifests are a cache: concurrent updates may drop entries, in which case
+the storage is probed again for the missing variations.
+"""
+import hashlib
+import json
+
+from django.core.files.base import ContentFile
+
+__all__ = (
+    'get_manifest_name', 'get_spec_hash', 'read_manifest', 'write_manifest',
+)
+
+
+def get_manifest_name(file_name):
+    """
+    Return the manifest file name of an original image.
+
+    The name keeps the extension of the original, since images that only
+    differ in their extension, e.g. ``logo.jpg`` and ``logo.png``, have
+    distinct variations.
+    """
+    return '%s.variations.json' % file_name
+
+
+def get_spec_hash(variation):
+    """Return a hash of all variation parameters that affect its rendering."""
+    spec = {
+        key: variation.get(key)
+        for key in ('width', 'height', 'crop', 'resample', 'kwargs')
+    }
+    if variation.get('formats'):
+        spec['formats'] = variation['formats']
+    spec = json.dumps(spec, sort_keys=True, default=str)
+    return hashlib.sha1(spec.encode()).hexdigest()[:12]  # nosec
+
+
+def read_manifest(storage, file_name):
+    """Return the manifest entries of an image by variation name."""
+    try:
+        with storage.open(get_manifest_name(file_name)) as f:
+            return json.loads(f.read())['variations']
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def write_manifest(storage, file_name, variations):
+    """Replace the manifest of an image."""
+    name = get_manifest_name(file_name)
+    if not getattr(storage, 'file_overwrite', False):
+        storage.delete(name)
+    content = json.dumps({'variations': variations}, sort_keys=True)
+    storage.save(name, ContentFile(content.encode()))
@@ -0,0 +1,103 @@
+"""Aggregate render timings sent through :data:`stdimage.signals.render_stage`."""
+import math
+from collections import defaultdict
+
+from .signals import render_stage
+
+__all__ = ('RenderStats',)
+
+STAGES = ('fetch', 'open', 'decode', 'process', 'encode', 'save', 'store')
+
+
+def percentile(values, p):
+    """Return the ``p``-th percentile of sorted values, using the nearest rank."""
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+class RenderStats:
+    """
+    Collect render stages and summarize them with percentiles.
+
+    Usage::
+
+        with RenderStats() as stats:
+            instance.image.render_variations()
+        print(stats.format_summary())
+
+    Args:
+        file_name (str):
+            Only collect stages of this source image, e.g. to tell
+            concurrent renders in the same process apart.
+
+    """
+
+    def __init__(self, file_name=None):
+        self.file_name = file_name
+        self.stages = defaultdict(list)
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disconnect()
+
+    def __getstate__(self):
+        return {'file_name': self.file_name, 'stages': dict(self.stages)}
+
+    def __setstate__(self, state):
+        self.file_name = state['file_name']
+        self.stages = defaultdict(list, state['stages'])
+
+    def connect(self):
+        render_stage.connect(self.receive, weak=False, dispatch_uid=id(self))
+
+    def disconnect(self):
+        render_stage.disconnect(dispatch_uid=id(self))
+
+    def receive(self, sender, stage, duration, bytes=None, file_name=None,
+                max_rss=None, **kwargs):
+        if self.file_name is None or self.file_name == file_name:
+            self.stages[stage].append((duration, bytes or 0, max_rss or 0))
+
+    def merge(self, other):
+        """Add the stages collected by another instance, e.g. of a worker."""
+        for stage, values in other.stages.items():
+            self.stages[stage].extend(values)
+
+    def summary(self):
+        """
+        Return the count, total and percentile durations and bytes by stage.
+
+        Durations are in seconds. ``max_rss`` is the highest lifetime peak
+        resident set size in bytes, that any process reported for the stage.
+        """
+        summary = {}
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        for stage in sorted(self.stages,
+                            key=lambda s: (order.get(s, len(order)), s)):
+            values = self.stages[stage]
+            durations = sorted(value[0] for value in values)
+            summary[stage] = {
+                'count': len(durations),
+                'total': sum(durations),
+                'p50': percentile(durations, 50),
+                'p90': percentile(durations, 90),
+                'p99': percentile(durations, 99),
+                'bytes': sum(value[1] for value in values),
+                'max_rss': max(value[2] for value in values),
+            }
+        return summary
+
+    def format_summary(self):
+        """Return the summary as a table in milliseconds and megabytes."""
+        lines = ['%-8s %8s %10s %10s %10s %10s %12s %10s' % (
+            'stage', 'count', 'total', 'p50', 'p90', 'p99', 'bytes', 'max_rss'
+        )]
+        for stage, row in self.summary().items():
+            lines.append('%-8s %8d %8.1fms %8.1fms %8.1fms %8.1fms %12d %8.1fMB' % (
+                stage, row['count'], row['total'] * 1000, row['p50'] * 1000,
+                row['p90'] * 1000, row['p99'] * 1000, row['bytes'],
+                row['max_rss'] / 1024 / 1024,
+            ))
+        return '\n'.join(lines)
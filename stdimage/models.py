@@ -1,32 +1,383 @@
+import asyncio
+import io
 import logging
+import math
 import os
-from io import BytesIO
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+from tempfile import SpooledTemporaryFile
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile, File
 from django.core.files.storage import default_storage
 from django.db.models import signals
 from django.db.models.fields.files import (ImageField, ImageFieldFile,
                                            ImageFileDescriptor,)
+from django.utils.translation import gettext_lazy
 from PIL import Image, ImageFile, ImageOps
 
-from .validators import MinSizeValidator
+from .cache import (get_cache_key, get_digest, get_render_cache, get_source_cache,
+                    get_source_key,)
+from .executors import InlineExecutor, get_executor
+from .manifest import get_manifest_name, get_spec_hash, read_manifest, write_manifest
+from .queue import RenderQueue
+from .signals import StageTimer
+from .storage import delete_files, existing_files, get_urls
+from .validators import BaseSizeValidator, MinSizeValidator
 
 logger = logging.getLogger()
 
 
+def get_thumbnail_size(size, box):
+    """
+    Return the dimensions of a thumbnail of an image of ``size`` within ``box``.
+
+    Like :meth:`PIL.Image.Image.thumbnail`, the aspect ratio is preserved
+    and images that already fit the box are left untouched.
+    """
+    width, height = size
+    x, y = map(math.floor, box)
+    if x >= width and y >= height:
+        return width, height
+    aspect = width / height
+
+    def round_aspect(number, key):
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    if x / y >= aspect:
+        x = round_aspect(y * aspect, key=lambda n: abs(aspect - n / y))
+    else:
+        y = round_aspect(
+            x / aspect, key=lambda n: 0 if n == 0 else abs(aspect - x / n)
+        )
+    return x, y
+
+
+class SourceTooLargeError(Exception):
+    """Raised if a source image exceeds the pixel budget of a render."""
+
+    def __init__(self, file_name, size, budget):
+        self.file_name = file_name
+        self.size = size
+        self.budget = budget
+        super().__init__(
+            'Image "%s" with %dx%d px exceeds the budget of %d px.' % (
+                file_name, size[0], size[1], budget,
+            )
+        )
+
+
+def get_pixel_budget(mode, max_pixels=None):
+    """
+    Return the maximum number of pixels a source image is decoded with.
+
+    The budget is the lower of ``max_pixels``, which defaults to the
+    ``STDIMAGE_MAX_PIXELS`` setting, and the ``STDIMAGE_MAX_MEMORY`` setting
+    in bytes divided by the bytes per pixel of the image ``mode``.
+    Returns ``None`` if neither is set.
+    """
+    max_pixels = max_pixels or getattr(settings, 'STDIMAGE_MAX_PIXELS', None)
+    max_memory = getattr(settings, 'STDIMAGE_MAX_MEMORY', None)
+    budgets = [max_pixels] if max_pixels else []
+    if max_memory:
+        # Pillow stores all multi band and 32-bit modes with 4 bytes per pixel.
+        pixel_bytes = 1 if mode in ('1', 'L', 'P') else 2 if mode.startswith('I;16') \
+            else 4
+        budgets.append(max_memory // pixel_bytes)
+    return min(budgets, default=None)
+
+
+class VariationRenderError(Exception):
+    """Raised if one or more variations of an image failed to render."""
+
+    def __init__(self, file_name, errors):
+        self.file_name = file_name
+        self.errors = errors
+        msg = 'Failed to render variations of "%s": %s' % (
+            file_name,
+            ', '.join('%s (%r)' % item for item in errors.items()),
+        )
+        super().__init__(msg)
+
+
+def render_task(field_class, variation, variation_name, image, image_format,
+                storage, keep=False, event=None, source_digest=None):
+    """
+    Resize, encode and save a single variation.
+
+    The function is defined on module level to be picklable for process pools.
+    ``event`` holds the ``file_name``, ``format`` and ``size`` of the source
+    image, that are sent with the :data:`stdimage.signals.render_stage` signal.
+    Given the ``source_digest``, the encoded files are stored in the render
+    cache, see :mod:`stdimage.cache`.
+
+    Returns:
+        tuple: The processed image, if ``keep`` is ``True``, and a dictionary
+        with the ``width``, ``height`` and byte ``size`` of the variation.
+
+    """
+    timer = StageTimer(field_class, variation=variation['name'], **(event or {}))
+    source_size = image.info.get('stdimage_source_size')
+    image = image.copy()
+    image.format = image_format
+    image, save_kargs = field_class.process_variation(variation, image=image)
+    if source_size:
+        size = field_class.get_variation_size(source_size, variation)
+        if image.size != size \
+                and all(abs(a - b) <= 1 for a, b in zip(image.size, size)):
+            # Drafts and intermediate reductions may round a pixel differently.
+            image = image.resize(size, variation['resample'])
+    timer('process')
+    cache = get_render_cache() if source_digest else None
+    files = [(variation_name, save_kargs, None)] + [
+        (
+            field_class.get_sibling_name(variation_name, extension),
+            dict(variation['formats'][extension],
+                 format=Image.registered_extensions()['.' + extension]),
+            extension,
+        )
+        for extension in field_class.get_sibling_extensions(variation_name, variation)
+    ]
+    sizes = [
+        field_class.save_variation(
+            name, image, kwargs, storage, timer=timer, cache=cache,
+            cache_key=cache and get_cache_key(
+                source_digest, field_class, variation, extension
+            ),
+        )
+        for name, kwargs, extension in files
+    ]
+    info = {'width': image.size[0], 'height': image.size[1], 'size': sizes[0]}
+    return (image if keep else None), info
+
+
+class VariationSchedule:
+    """
+    Order in which the variations of a decoded image are rendered.
+
+    Variations derived from another variation become ready as soon as
+    their base has been processed. Should a base fail, its dependents
+    are derived from the source image instead. The schedule only
+    returns the arguments of :func:`render_task`, callers submit and
+    await the tasks, e.g. using an executor or an event loop.
+    """
+
+    def __init__(self, field_class, image, pending, storage, file_name=None,
+                 source_digest=None):
+        self.field_class = field_class
+        self.image = image
+        self.storage = storage
+        self.source_digest = source_digest
+        self.plan = field_class.plan_variations(image.size, pending)
+        self.dependents = [[] for _ in self.plan]
+        for i, (_, _, base) in enumerate(self.plan):
+            if base is not None:
+                self.dependents[base].append(i)
+        self.event = field_class.get_render_event(file_name, image)
+        self.rendered, self.errors = {}, {}
+
+    def get_task(self, i, base_image):
+        """Return the index and :func:`render_task` arguments of a variation."""
+        variation, variation_name, _ = self.plan[i]
+        return i, (
+            self.field_class, variation, variation_name, base_image,
+            self.image.format, self.storage, bool(self.dependents[i]),
+            self.event, self.source_digest,
+        )
+
+    def start(self):
+        """Return the tasks of all variations derived from the source image."""
+        return [
+            self.get_task(i, self.image)
+            for i, (_, _, base) in enumerate(self.plan) if base is None
+        ]
+
+    def finish(self, i, result):
+        """Record the result of a task and return the tasks now ready."""
+        base_image, self.rendered[self.plan[i][0]['name']] = result
+        return [self.get_task(j, base_image) for j in self.dependents[i]]
+
+    def fail(self, i, error):
+        """Record the error of a task and return the tasks now ready."""
+        variation_name = self.plan[i][0]['name']
+        logger.error(
+            'Failed to render variation "%s".', variation_name, exc_info=error
+        )
+        self.errors[variation_name] = error
+        return [self.get_task(j, self.image) for j in self.dependents[i]]
+
+
+class SpooledVariationFile(SpooledTemporaryFile):
+    """
+    Spooled buffer of an encoded variation.
+
+    Encoders like Pillow's JPEG plugin write directly to the file descriptor
+    of their output, if it has one, which would roll the buffer over to disk
+    before a single byte is written. Without a file descriptor they write
+    to the buffer, which only spills once it exceeds ``max_size``.
+    """
+
+    def fileno(self):
+        raise io.UnsupportedOperation('fileno')
+
+
 class StdImageFileDescriptor(ImageFileDescriptor):
     """The variation property of the field is accessible in instance cases."""
 
-    def __set__(self, instance, value):
-        super().__set__(instance, value)
-        self.field.set_variations(instance)
+
+_render_locks = {}
+_render_locks_lock = threading.Lock()
+
+
+class VariationFieldFile(ImageFieldFile):
+    """
+    ImageFieldFile of a single variation of a StdImageFieldFile.
+
+    If the field renders variations on demand, the variation is rendered
+    the first time its ``url``, ``path`` or content is accessed.
+
+    Siblings of the variation in other formats are accessible as attributes
+    named after their extension, e.g. ``instance.image.thumbnail.webp``.
+
+    The ``width`` and ``height`` are computed from the dimensions of the
+    original image, if they are known without opening it, or read from the
+    manifest. Only otherwise the variation file is opened.
+    """
+
+    def __init__(self, source, variation, extension=None):
+        variation_name = source.get_variation_name(source.name, variation['name'])
+        if extension is not None:
+            variation_name = source.get_sibling_name(variation_name, extension)
+        super().__init__(source.instance, source.field, variation_name)
+        self.source = source
+        self.variation = variation
+        self.extension = extension
+        self._rendered = not source.field.render_on_demand
+
+    def __getattr__(self, name):
+        variation = self.__dict__.get('variation')
+        if variation is None or self.__dict__.get('extension') is not None \
+                or name not in (variation.get('formats') or ()):
+            raise AttributeError(
+                '%r object has no attribute %r' % (type(self).__name__, name)
+            )
+        sibling = VariationFieldFile(self.source, variation, name)
+        sibling._rendered = self._rendered
+        self.__dict__[name] = sibling
+        return sibling
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.update(
+            source=self.source,
+            variation=self.variation,
+            extension=self.extension,
+            _rendered=self._rendered,
+        )
+        return state
+
+    def ensure_rendered(self):
+        """
+        Render and save the variation, unless it already exists.
+
+        Concurrent calls for the same file within a process will wait for
+        the first call to finish, rather than rendering the variation twice.
+        The variation is always rendered inline, since the file must exist
+        once this method returns, even if the default executor is a queue.
+        """
+        if self._rendered:
+            return
+        key = self.storage, self.name
+        with _render_locks_lock:
+            lock = _render_locks.setdefault(key, threading.Lock())
+        try:
+            with lock:
+                if self._rendered:
+                    return
+                self.source.render_variation(
+                    self.source.name, self.variation, replace=False,
+                    storage=self.storage, executor='inline',
+                    manifest=self.field.manifest, max_pixels=self.field.max_pixels,
+                )
+                self._rendered = True
+        finally:
+            with _render_locks_lock:
+                _render_locks.pop(key, None)
+
+    @property
+    def path(self):
+        self.ensure_rendered()
+        return super().path
+
+    @property
+    def url(self):
+        self.ensure_rendered()
+        return super().url
+
+    @property
+    def size(self):
+        self.ensure_rendered()
+        return super().size
+
+    def _get_file(self):
+        self.ensure_rendered()
+        return super()._get_file()
+
+    file = property(_get_file, ImageFieldFile._set_file, ImageFieldFile._del_file)
+
+    def open(self, mode='rb'):
+        self.ensure_rendered()
+        return super().open(mode)
+
+    def _get_image_dimensions(self):
+        if not hasattr(self, '_dimensions_cache'):
+            size = self.source.get_source_size()
+            if size is not None:
+                self._dimensions_cache = self.source.get_variation_size(
+                    size, self.variation
+                )
+            elif self.field.manifest:
+                entry = self.source.get_manifest().get(self.variation['name'])
+                if entry and entry.get('spec') == get_spec_hash(self.variation):
+                    self._dimensions_cache = entry['width'], entry['height']
+        return super()._get_image_dimensions()
 
 
 class StdImageFieldFile(ImageFieldFile):
     """Like ImageFieldFile but handles variations."""
 
+    draft_reducing_gap = 2
+    crop_aspect_tolerance = 0.01
+
+    def __getattr__(self, name):
+        """
+        Return the variation file for a variation name.
+
+        Variation files are created on first access and cached on the field
+        file, rather than for every model instance that is loaded.
+        """
+        field = self.__dict__.get('field')
+        if field is None or name not in field.variations \
+                or not self or not self._committed:
+            raise AttributeError(
+                '%r object has no attribute %r' % (type(self).__name__, name)
+            )
+        cache = self.__dict__.setdefault('_variation_files', {})
+        file_name, variation_file = cache.get(name, (None, None))
+        if file_name != self.name:
+            variation_file = VariationFieldFile(self, field.variations[name])
+            cache[name] = self.name, variation_file
+        return variation_file
+
     def save(self, name, content, save=True):
+        source_digest = None
+        if not self.field.render_on_demand and get_render_cache() is not None:
+            source_digest = get_digest(content)
         super().save(name, content, save)
+        self.delete_cached_source()
+        if self.field.render_on_demand:
+            return
         render_variations = self.field.render_variations
         if callable(render_variations):
             render_variations = render_variations(
@@ -41,42 +392,599 @@ class StdImageFieldFile(ImageFieldFile):
                 ) % type(render_variations)
             raise TypeError(msg)
         if render_variations:
-            self.render_variations()
+            self.render_variations(source_digest=source_digest)
 
     @staticmethod
     def is_smaller(img, variation):
         return img.size[0] > variation['width'] \
             or img.size[1] > variation['height']
 
-    def render_variations(self, replace=True):
+    def get_source_size(self):
+        """
+        Return the dimensions of the original image, if known without storage I/O.
+
+        The dimensions are taken from the model's ``width_field`` and
+        ``height_field``, or from a previous access of ``width`` or ``height``.
+        Returns ``None`` otherwise.
+        """
+        if '_dimensions_cache' in self.__dict__:
+            return self._dimensions_cache
+        width_field, height_field = self.field.width_field, self.field.height_field
+        if width_field and height_field:
+            size = (getattr(self.instance, width_field),
+                    getattr(self.instance, height_field))
+            if all(size):
+                return size
+        return None
+
+    @classmethod
+    def get_variation_size(cls, size, variation):
+        """
+        Return the dimensions of a variation of an original image of ``size``.
+
+        Mirrors :meth:`process_variation`: cropped variations match the
+        variation's dimensions, resized variations preserve the aspect ratio
+        and images are never resized, if they already fit the variation.
+        Variations of sources exceeding the pixel budget may be smaller.
+        """
+        width, height = variation['width'], variation['height']
+        if width is None or height is None \
+                or not (size[0] > width or size[1] > height):
+            return tuple(size)
+        if variation['crop']:
+            return width, height
+        return get_thumbnail_size(size, (width, height))
+
+    def render_variations(self, replace=True, source_digest=None):
         """Render all image variations and saves them to the storage."""
-        for _, variation in self.field.variations.items():
-            self.render_variation(self.name, variation, replace, self.storage)
+        self.render_all_variations(
+            self.name, self.field.variations, replace, self.storage,
+            executor=self.field.render_executor, manifest=self.field.manifest,
+            max_pixels=self.field.max_pixels, source_digest=source_digest,
+        )
 
     @classmethod
     def render_variation(cls, file_name, variation, replace=True,
-                         storage=default_storage):
+                         storage=default_storage, manifest=False, max_pixels=None,
+                         executor=None):
         """Render an image variation and saves it to the storage."""
         variation_name = cls.get_variation_name(file_name, variation['name'])
+        cls.render_all_variations(
+            file_name, {variation['name']: variation}, replace, storage,
+            executor=executor, manifest=manifest, max_pixels=max_pixels,
+        )
+        return variation_name
+
+    @classmethod
+    def render_all_variations(cls, file_name, variations, replace=True,
+                              storage=default_storage, executor=None,
+                              manifest=False, max_pixels=None, source_digest=None):
+        """
+        Render multiple image variations and saves them to the storage.
+
+        The source file is only fetched and decoded once, no matter how
+        many variations need to be rendered. Each variation is resized,
+        encoded and saved as a separate task of the given executor.
+
+        Args:
+            executor (str, concurrent.futures.Executor, stdimage.queue.RenderQueue):
+                ``"inline"``, ``"thread"``, ``"process"``, ``"queue"``,
+                an executor or a render queue instance,
+                see :func:`stdimage.executors.get_executor`.
+                Render queues defer rendering and return immediately.
+            manifest (bool):
+                Record rendered variations in a manifest next to the image,
+                and consult it instead of probing the storage,
+                see :mod:`stdimage.manifest`.
+            max_pixels (int):
+                Pixel budget of the decoded source image,
+                see :func:`get_pixel_budget`.
+            source_digest (str):
+                Digest of the source image. If given and a render cache is
+                configured, cached variations are restored instead of being
+                rendered, see :mod:`stdimage.cache`.
+
+        Returns:
+            list: Names of the rendered variation files.
+
+        Raises:
+            SourceTooLargeError: If the source image exceeds the pixel budget.
+            VariationRenderError: If any of the variations failed to render.
+
+        """
+        executor = get_executor(executor)
+        if isinstance(executor, RenderQueue):
+            executor.enqueue(cls, file_name, variations, replace, storage, manifest,
+                             max_pixels, source_digest)
+            return []
+
+        entries = read_manifest(storage, file_name) if manifest else None
+        pending = cls.get_pending_variations(
+            file_name, variations, replace, storage, entries
+        )
+        if not pending:
+            return []
+
+        remaining, rendered, errors = pending, {}, {}
+        if source_digest:
+            remaining, rendered = cls.restore_variations(
+                source_digest, pending, storage
+            )
+        if remaining:
+            with cls.open_image(file_name, remaining, storage, max_pixels) as img:
+                results, errors = cls.run_variation_tasks(
+                    img, remaining, storage, executor, file_name, source_digest
+                )
+            rendered.update(results)
+        return cls.finish_render(file_name, pending, rendered, errors, storage, entries)
+
+    @classmethod
+    def finish_render(cls, file_name, pending, rendered, errors, storage,
+                      entries=None):
+        """
+        Update the manifest and raise any errors of a render.
+
+        Args:
+            rendered (dict): Render results of successful variations by name.
+            errors (dict): Exceptions of failed variations by name.
+            entries (dict): Manifest entries, ``None`` if manifests are disabled.
+
+        """
+        if entries is not None and rendered:
+            for variation, variation_name in pending:
+                if variation['name'] in rendered:
+                    entries[variation['name']] = dict(
+                        rendered[variation['name']],
+                        name=variation_name,
+                        spec=get_spec_hash(variation),
+                    )
+            write_manifest(storage, file_name, entries)
+        if errors:
+            raise VariationRenderError(file_name, errors) \
+                from next(iter(errors.values()))
+        return [variation_name for _, variation_name in pending]
+
+    async def arender_variations(self, replace=True, source_digest=None):
+        """Render all image variations without blocking the event loop."""
+        await self.arender_all_variations(
+            self.name, self.field.variations, replace, self.storage,
+            executor=self.field.render_executor, manifest=self.field.manifest,
+            max_pixels=self.field.max_pixels, source_digest=source_digest,
+        )
+
+    @classmethod
+    async def arender_variation(cls, file_name, variation, replace=True,
+                                storage=default_storage, manifest=False,
+                                max_pixels=None):
+        """Render an image variation without blocking the event loop."""
+        variation_name = cls.get_variation_name(file_name, variation['name'])
+        await cls.arender_all_variations(
+            file_name, {variation['name']: variation}, replace, storage,
+            manifest=manifest, max_pixels=max_pixels,
+        )
+        return variation_name
+
+    @classmethod
+    async def arender_all_variations(cls, file_name, variations, replace=True,
+                                     storage=default_storage, executor=None,
+                                     manifest=False, max_pixels=None,
+                                     source_digest=None):
+        """
+        Asynchronous version of :meth:`render_all_variations`.
+
+        Storage access and decoding run in the event loop's default executor.
+        Variations are resized, encoded and saved concurrently, using the
+        given executor or the event loop's default executor for ``"inline"``.
+        """
+        loop = asyncio.get_running_loop()
+        executor = get_executor(executor)
+        if isinstance(executor, RenderQueue):
+            await loop.run_in_executor(
+                None, executor.enqueue, cls, file_name, variations, replace, storage,
+                manifest, max_pixels, source_digest,
+            )
+            return []
+        if isinstance(executor, InlineExecutor):
+            executor = None
+
+        entries = None
+        if manifest:
+            entries = await loop.run_in_executor(
+                None, read_manifest, storage, file_name
+            )
+        pending = await loop.run_in_executor(
+            None, cls.get_pending_variations, file_name, variations, replace, storage,
+            entries,
+        )
+        if not pending:
+            return []
+
+        remaining, rendered = pending, {}
+        if source_digest:
+            remaining, rendered = await loop.run_in_executor(
+                None, cls.restore_variations, source_digest, pending, storage
+            )
+        if not remaining:
+            return await loop.run_in_executor(
+                None, cls.finish_render, file_name, pending, rendered, {}, storage,
+                entries,
+            )
+
+        img = await loop.run_in_executor(
+            None, cls.open_image, file_name, remaining, storage, max_pixels
+        )
+        with img:
+            schedule = VariationSchedule(
+                cls, img, remaining, storage, file_name, source_digest
+            )
+
+            async def run(i, args):
+                try:
+                    result = await loop.run_in_executor(executor, render_task, *args)
+                except Exception as e:
+                    ready = schedule.fail(i, e)
+                else:
+                    ready = schedule.finish(i, result)
+                await asyncio.gather(*(run(*task) for task in ready))
+
+            await asyncio.gather(*(run(*task) for task in schedule.start()))
+
+        rendered.update(schedule.rendered)
+        return await loop.run_in_executor(
+            None, cls.finish_render, file_name, pending, rendered, schedule.errors,
+            storage, entries,
+        )
+
+    @classmethod
+    def open_image(cls, file_name, pending, storage, max_pixels=None, source=None):
+        """
+        Fetch and decode the source image of the pending variations.
+
+        Images exceeding the pixel budget are rejected based on their header,
+        before any pixel data is decoded. The storage file is closed once the
+        image data is loaded. A ``source`` file, e.g. prefetched by
+        :class:`stdimage.pipeline.RenderPipeline`, is read instead of the storage.
+        Otherwise the source is opened with :meth:`open_source`.
+        """
+        ImageFile.LOAD_TRUNCATED_IMAGES = True
+        timer = StageTimer(cls, file_name=file_name, variation=None,
+                           format=None, size=None)
+        with source if source is not None else cls.open_source(file_name, storage) \
+                as f:
+            timer('open')
+            img = Image.open(f)
+            img.info['stdimage_source_size'] = img.size
+            try:
+                cls.draft_image(img, [v for v, _ in pending], max_pixels)
+                budget = get_pixel_budget(img.mode, max_pixels)
+                if budget and img.size[0] * img.size[1] > budget:
+                    raise SourceTooLargeError(file_name, img.size, budget)
+                img.load()
+            except Exception:
+                img.close()
+                raise
+            timer('decode', f.tell(), format=img.format, size=img.size)
+        return img
+
+    @staticmethod
+    def open_source(file_name, storage):
+        """
+        Open a source image, reading it from the source cache if configured.
+
+        Jobs that render one variation at a time fetch the source from the
+        storage only once, see :func:`stdimage.cache.get_source_cache`.
+        """
+        cache = get_source_cache()
+        if cache is None:
+            return storage.open(file_name)
+        key = get_source_key(storage, file_name)
+        content = cache.get(key)
+        if content is None:
+            with storage.open(file_name) as f:
+                content = f.read()
+            cache.set(key, content)
+        return ContentFile(content, name=file_name)
+
+    def delete_cached_source(self):
+        """Remove the image from the source cache, e.g. once it is replaced."""
+        cache = get_source_cache()
+        if cache is not None:
+            cache.delete(get_source_key(self.storage, self.name))
+
+    @staticmethod
+    def get_render_event(file_name, image):
+        """Return the source details sent with the render signals."""
+        return {'file_name': file_name, 'format': image.format, 'size': image.size}
+
+    @classmethod
+    def restore_variations(cls, source_digest, pending, storage):
+        """
+        Save pending variations, that are found in the render cache.
+
+        A variation is only restored, if all of its siblings are cached, too.
+
+        Returns:
+            tuple: The variations that still need rendering, and the render
+            results of the restored variations by name.
+
+        """
+        cache = get_render_cache()
+        if cache is None:
+            return pending, {}
+        keys = {
+            variation['name']: [
+                (name, get_cache_key(source_digest, cls, variation, extension))
+                for name, extension in zip(
+                    cls.get_file_names([(variation, variation_name)]),
+                    [None, *cls.get_sibling_extensions(variation_name, variation)],
+                )
+            ]
+            for variation, variation_name in pending
+        }
+        found = cache.get_many([key for k in keys.values() for _, key in k])
+        remaining, restored = [], {}
+        for variation, variation_name in pending:
+            files = keys[variation['name']]
+            if not all(key in found for _, key in files):
+                remaining.append((variation, variation_name))
+                continue
+            for name, key in files:
+                storage.save(name, ContentFile(found[key]))
+            content = found[files[0][1]]
+            with Image.open(io.BytesIO(content)) as img:
+                width, height = img.size
+            restored[variation['name']] = {
+                'width': width, 'height': height, 'size': len(content),
+            }
+            logger.info('Restored "%s" from the render cache.', variation_name)
+        return remaining, restored
+
+    @classmethod
+    def get_pending_variations(cls, file_name, variations, replace, storage,
+                               manifest=None):
+        """
+        Return ``(variation, variation_name)`` pairs that need rendering.
+
+        Unless variations are replaced, variations listed in the ``manifest``
+        entries are skipped without probing the storage, as long as their
+        specification did not change since they were rendered. Outdated
+        variations are replaced.
+        """
         file_overwrite = getattr(storage, 'file_overwrite', False)
-        if not replace and storage.exists(variation_name):
-            logger.info('File "%s" already exists.', variation_name)
-            return variation_name
-        elif replace and not file_overwrite and storage.exists(variation_name):
+        pending = [
+            (variation, cls.get_variation_name(file_name, variation['name']))
+            for variation in variations.values()
+        ]
+        outdated = []
+        if not replace and manifest:
+            outdated = [
+                p for p in pending if p[0]['name'] in manifest
+                and manifest[p[0]['name']].get('spec') != get_spec_hash(p[0])
+            ]
+            pending = [p for p in pending if p[0]['name'] not in manifest]
+            for _, variation_name in outdated:
+                logger.info(
+                    'File "%s" is outdated and will be re-rendered.',
+                    variation_name
+                )
+            if not file_overwrite:
+                delete_files(storage, cls.get_file_names(outdated))
+        if replace and file_overwrite or not pending:
+            return pending + outdated
+
+        existing = existing_files(storage, cls.get_file_names(pending))
+        if not replace:
+            missing = []
+            for p in pending:
+                if existing.issuperset(cls.get_file_names([p])):
+                    logger.info('File "%s" already exists.', p[1])
+                else:
+                    missing.append(p)
+            if not file_overwrite:
+                # Variations with missing siblings are rendered again.
+                delete_files(
+                    storage, existing.intersection(cls.get_file_names(missing))
+                )
+            return missing + outdated
+
+        for variation_name in existing:
             logger.warning(
-                'File "%s" already exists and will be overwritten.', variation_name
+                'File "%s" already exists and will be overwritten.',
+                variation_name
             )
-            storage.delete(variation_name)
+        delete_files(storage, existing)
+        return pending
 
-        ImageFile.LOAD_TRUNCATED_IMAGES = True
-        with storage.open(file_name) as f:
-            with Image.open(f) as img:
-                img, save_kargs = cls.process_variation(variation, image=img)
-                with BytesIO() as file_buffer:
-                    img.save(file_buffer, **save_kargs)
-                    f = ContentFile(file_buffer.getvalue())
-                    storage.save(variation_name, f)
-        return variation_name
+    @classmethod
+    def get_file_names(cls, pending):
+        """Yield the file names of pending variations, including their siblings."""
+        for variation, variation_name in pending:
+            yield variation_name
+            for extension in cls.get_sibling_extensions(variation_name, variation):
+                yield cls.get_sibling_name(variation_name, extension)
+
+    @staticmethod
+    def get_sibling_extensions(variation_name, variation):
+        """
+        Return the extensions of the siblings of a variation.
+
+        Formats that match the extension of the variation itself are skipped,
+        since the variation already is the file of that format.
+        """
+        extension = os.path.splitext(variation_name)[1][1:].lower()
+        return [
+            sibling for sibling in variation.get('formats') or ()
+            if sibling.lower() != extension
+        ]
+
+    @staticmethod
+    def get_sibling_name(variation_name, extension):
+        """Return the file name of a variation encoded in another format."""
+        return '%s.%s' % (os.path.splitext(variation_name)[0], extension)
+
+    @staticmethod
+    def get_variation_scale(size, variation):
+        """Return the scale of a variation relative to an image of ``size``."""
+        if variation['width'] is None or variation['height'] is None:
+            return 1
+        scales = variation['width'] / size[0], variation['height'] / size[1]
+        scale = max(scales) if variation['crop'] else min(scales)
+        return min(scale, 1)
+
+    @classmethod
+    def draft_image(cls, image, variations, max_pixels=None):
+        """
+        Configure an image that has not been loaded yet for reduced decoding.
+
+        Some decoders, like libjpeg, can decode an image at 1/2, 1/4 or 1/8
+        scale at a fraction of the time and memory of a full decode.
+        The image is decoded at least ``draft_reducing_gap`` times larger
+        than the largest variation, to preserve the quality of the following
+        resampling. Images exceeding the pixel budget are reduced further to
+        fit the budget, even if the variations end up smaller than defined.
+        Formats without draft support are left untouched.
+        """
+        width, height = image.size
+        draft_size = None
+        scale = max(cls.get_variation_scale(image.size, v) for v in variations)
+        scale *= cls.draft_reducing_gap
+        if scale < 1:
+            draft_size = tuple(math.ceil(i * scale) for i in image.size)
+
+        budget = get_pixel_budget(image.mode, max_pixels)
+        if budget and width * height > budget:
+            reduce = next((
+                factor for factor in (2, 4, 8)
+                if math.ceil(width / factor) * math.ceil(height / factor) <= budget
+            ), 8)
+            budget_size = max(width // reduce, 1), max(height // reduce, 1)
+            draft_size = tuple(map(min, draft_size or budget_size, budget_size))
+
+        if draft_size:
+            image.draft(None, draft_size)
+
+    @classmethod
+    def plan_variations(cls, size, pending):
+        """
+        Return the order in which variations of an image are rendered.
+
+        Variations are processed from largest to smallest. Each variation is
+        derived from the smallest previously processed variation, that is
+        still larger than the variation itself, see :meth:`is_base`.
+
+        Returns:
+            list: ``(variation, variation_name, base)`` triples, where
+            ``base`` is the index of the variation to derive from,
+            or ``None`` for the source image.
+
+        """
+        pending = sorted(
+            pending,
+            key=lambda p: cls.get_variation_scale(size, p[0]),
+            reverse=True,
+        )
+        plan = []
+        for variation, variation_name in pending:
+            scale = cls.get_variation_scale(size, variation)
+            bases = [
+                (cls.get_variation_scale(size, v), i)
+                for i, (v, _, _) in enumerate(plan)
+                if cls.get_variation_scale(size, v) > scale
+                and cls.is_base(v, variation)
+            ]
+            base = min(bases)[1] if bases else None
+            plan.append((variation, variation_name, base))
+        return plan
+
+    @classmethod
+    def is_base(cls, base, variation):
+        """
+        Return whether a variation can be derived from a larger variation.
+
+        Resized variations preserve the whole image and can be the base of
+        any other variation. Cropped variations can only be the base of
+        cropped variations with the same aspect ratio, within a relative
+        tolerance of ``crop_aspect_tolerance``. These share the crop box,
+        which is only resampled from the source once, for the largest crop.
+        """
+        if not base['crop']:
+            return True
+        sizes = base['width'], base['height'], variation['width'], variation['height']
+        if not variation['crop'] or None in sizes:
+            return False
+        base_ratio = base['width'] / base['height']
+        ratio = variation['width'] / variation['height']
+        return abs(base_ratio - ratio) <= cls.crop_aspect_tolerance * ratio
+
+    @classmethod
+    def run_variation_tasks(cls, image, pending, storage, executor, file_name=None,
+                            source_digest=None):
+        """
+        Render the given variations of a decoded image using an executor.
+
+        Variations are submitted in the order of a :class:`VariationSchedule`.
+
+        Returns:
+            tuple: Render results of successful and exceptions of failed
+            variations, both by variation name.
+
+        """
+        schedule = VariationSchedule(
+            cls, image, pending, storage, file_name, source_digest
+        )
+        futures = {}
+
+        def submit(tasks):
+            for i, args in tasks:
+                futures[executor.submit(render_task, *args)] = i
+
+        submit(schedule.start())
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    submit(schedule.fail(i, e))
+                else:
+                    submit(schedule.finish(i, result))
+        return schedule.rendered, schedule.errors
+
+    @staticmethod
+    def save_variation(variation_name, image, save_kargs, storage, timer=None,
+                       cache=None, cache_key=None):
+        """
+        Encode a processed variation and save it to the storage.
+
+        The image is encoded into a buffer, that is handed to the storage
+        without being copied. Buffers exceeding ``STDIMAGE_SPOOL_MAX_SIZE``
+        bytes (default: 5 MiB, ``0`` keeps everything in memory) are spilled
+        to a temporary file inside ``STDIMAGE_SPOOL_DIR``.
+        The encode and save stages are reported to the optional
+        :class:`stdimage.signals.StageTimer`. Given a ``cache``, the encoded
+        file is also stored under ``cache_key``.
+
+        Returns:
+            int: Size of the encoded variation in bytes.
+
+        """
+        with SpooledVariationFile(
+            max_size=getattr(settings, 'STDIMAGE_SPOOL_MAX_SIZE', 5 * 1024 * 1024),
+            dir=getattr(settings, 'STDIMAGE_SPOOL_DIR', None),
+        ) as file_buffer:
+            image.save(file_buffer, **save_kargs)
+            size = file_buffer.tell()
+            if timer is not None:
+                timer('encode', size)
+            file_buffer.seek(0)
+            storage.save(variation_name, File(file_buffer, name=variation_name))
+            if timer is not None:
+                timer('save', size)
+            if cache is not None:
+                file_buffer.seek(0)
+                cache.set(cache_key, file_buffer.read())
+        return size
 
     @classmethod
     def process_variation(cls, variation, image):
@@ -141,12 +1049,82 @@ class StdImageFieldFile(ImageFieldFile):
 
     def delete(self, save=True):
         self.delete_variations()
+        self.delete_cached_source()
         super().delete(save)
 
     def delete_variations(self):
-        for variation in self.field.variations:
-            variation_name = self.get_variation_name(self.name, variation)
-            self.storage.delete(variation_name)
+        names = list(self.get_file_names(
+            (variation, self.get_variation_name(self.name, variation['name']))
+            for variation in self.field.variations.values()
+        ))
+        if self.field.manifest:
+            names.append(get_manifest_name(self.name))
+        delete_files(self.storage, names)
+
+    def get_manifest(self):
+        """Return the manifest entries of all rendered variations by name."""
+        return read_manifest(self.storage, self.name)
+
+    def srcset(self, variations=None):
+        """
+        Return the ``srcset`` attribute of the variations, smallest first.
+
+        Args:
+            variations (list): Names of the variations, defaults to all.
+
+        """
+        return self.get_srcsets([self], variations)[0]
+
+    @staticmethod
+    def get_srcsets(field_files, variations=None):
+        """
+        Return the ``srcset`` attributes of multiple images, e.g. of a grid.
+
+        The URLs of all variations are built with a single call to
+        :func:`stdimage.storage.get_urls` per storage. Widths are taken
+        from the variation files, which avoids opening them if possible.
+        Variations rendered on demand are rendered first, once per image.
+        """
+        field_files = list(field_files)
+        candidates, storages = [], {}
+        for field_file in field_files:
+            if not field_file or not field_file._committed:
+                candidates.append([])
+                continue
+            names = variations or list(field_file.field.variations)
+            files = [getattr(field_file, name) for name in names]
+            pending = {f.variation['name']: f.variation for f in files
+                       if not f._rendered}
+            if pending:
+                field_file.render_all_variations(
+                    field_file.name, pending, replace=False,
+                    storage=field_file.storage, executor='inline',
+                    manifest=field_file.field.manifest,
+                    max_pixels=field_file.field.max_pixels,
+                )
+                for f in files:
+                    f._rendered = True
+            _, storage_names = storages.setdefault(
+                id(field_file.storage), (field_file.storage, set())
+            )
+            storage_names.update(f.name for f in files)
+            candidates.append(sorted((f.width, f.name) for f in files))
+
+        urls = {}
+        for storage, names in storages.values():
+            names = sorted(names)
+            urls[id(storage)] = dict(zip(names, get_urls(storage, names)))
+
+        srcsets = []
+        for field_file, files in zip(field_files, candidates):
+            storage_urls = urls.get(id(field_file.storage))
+            widths, srcset = set(), []
+            for width, name in files:
+                if width not in widths:
+                    widths.add(width)
+                    srcset.append('%s %dw' % (storage_urls[name], width))
+            srcsets.append(', '.join(srcset))
+        return srcsets
 
 
 class StdImageField(ImageField):
@@ -176,7 +1154,8 @@ class StdImageField(ImageField):
 
     def __init__(self, verbose_name=None, name=None, variations=None,
                  render_variations=True, force_min_size=False, delete_orphans=False,
-                 **kwargs):
+                 render_executor=None, render_on_demand=False, manifest=False,
+                 max_pixels=None, formats=None, **kwargs):
         """
         Standardized ImageField for Django.
 
@@ -202,6 +1181,33 @@ class StdImageField(ImageField):
                 is assigned or the field is cleared. This will only remove work for
                 Django forms. If you unassign or reassign a field in code, you will
                 need to remove the orphaned files yourself.
+            render_executor (str, concurrent.futures.Executor, RenderQueue):
+                Executor used to render the variations of an image concurrently.
+                Either ``"inline"``, ``"thread"``, ``"process"`` or an executor
+                instance. ``"queue"`` or a ``stdimage.queue.RenderQueue``
+                instance defers rendering to a queue worker. Defaults to the
+                ``STDIMAGE_RENDER_EXECUTOR`` setting, which defaults to
+                ``"inline"``.
+            render_on_demand (bool):
+                If ``True``, variations are not rendered when a file is saved,
+                but the first time a variation's ``url``, ``path`` or content
+                is accessed. Default: ``False``
+            manifest (bool):
+                If ``True``, rendered variations are recorded in a JSON manifest
+                next to the original image, which is consulted instead of probing
+                the storage for existing variations. Default: ``False``
+            max_pixels (int):
+                Maximum number of pixels a source image is decoded with.
+                Larger JPEGs are decoded at a reduced size, other images are
+                rejected with a ``ValidationError`` when the field is validated,
+                or a ``SourceTooLargeError`` before they are decoded.
+                Defaults to the ``STDIMAGE_MAX_PIXELS`` setting, see also the
+                ``STDIMAGE_MAX_MEMORY`` setting.
+            formats (list, dict):
+                File extensions, e.g. ``["webp"]``, each variation is also saved
+                in, next to the variation itself. A dict maps extensions to
+                save arguments, e.g. ``{"webp": {"quality": 75}}``. Variations
+                may override the formats of the field with a ``formats`` key.
 
         """
         if not variations:
@@ -219,6 +1225,11 @@ class StdImageField(ImageField):
         self._variations = variations
         self.force_min_size = force_min_size
         self.render_variations = render_variations
+        self.render_executor = render_executor
+        self.render_on_demand = render_on_demand
+        self.manifest = manifest
+        self.max_pixels = max_pixels
+        self.formats = formats
         self.variations = {}
         self.delete_orphans = delete_orphans
 
@@ -238,10 +1249,21 @@ class StdImageField(ImageField):
     def add_variation(self, name, params):
         variation = self.def_variation.copy()
         variation["kwargs"] = {}
+        variation["formats"] = self.formats
         if isinstance(params, (list, tuple)):
             variation.update(dict(zip(("width", "height", "crop", "kwargs"), params)))
         else:
             variation.update(params)
+        formats = variation["formats"] or {}
+        if not isinstance(formats, dict):
+            formats = {extension: {} for extension in formats}
+        for extension in formats:
+            image_format = Image.registered_extensions().get('.%s' % extension)
+            if image_format not in Image.SAVE:
+                msg = ('"formats" expects extensions of image formats Pillow'
+                       ' can save, but got %r') % extension
+                raise ValueError(msg)
+        variation["formats"] = formats
         variation["name"] = name
         self.variations[name] = variation
 
@@ -252,6 +1274,9 @@ class StdImageField(ImageField):
         Variation attribute will be of the same class as the original image, so
         "path", "url"... properties can be used
 
+        Variations are resolved lazily on first attribute access, calling this
+        method is only required to create all variation objects upfront.
+
         :param instance: FileField
         """
         deferred_field = self.name in instance.get_deferred_fields()
@@ -259,13 +1284,7 @@ class StdImageField(ImageField):
             field = getattr(instance, self.name)
             if field._committed:
                 for name, variation in list(self.variations.items()):
-                    variation_name = self.attr_class.get_variation_name(
-                        field.name,
-                        variation['name']
-                    )
-                    variation_field = ImageFieldFile(instance,
-                                                     self,
-                                                     variation_name)
+                    variation_field = VariationFieldFile(field, variation)
                     setattr(field, name, variation_field)
 
     def post_delete_callback(self, sender, instance, **kwargs):
@@ -274,7 +1293,6 @@ class StdImageField(ImageField):
     def contribute_to_class(self, cls, name):
         """Generate all operations on specified signals."""
         super().contribute_to_class(cls, name)
-        signals.post_init.connect(self.set_variations, sender=cls)
         if self.delete_orphans:
             signals.post_delete.connect(self.post_delete_callback, sender=cls)
 
@@ -282,6 +1300,47 @@ class StdImageField(ImageField):
         super().validate(value, model_instance)
         if self.force_min_size:
             MinSizeValidator(self.min_size[0], self.min_size[1])(value)
+        self.validate_pixel_budget(value)
+
+    def validate_pixel_budget(self, value):
+        """
+        Reject uploads exceeding the pixel budget, before they are stored.
+
+        Only the image header is parsed, and only if a budget is configured.
+        JPEGs are accepted, if they fit the budget at a reduced scale, just
+        like :meth:`StdImageFieldFile.open_image` decodes them. Files that
+        are not images are left to the other validators.
+        """
+        if not value or getattr(value, '_committed', True) \
+                or not self.variations or self.render_variations is False:
+            return
+        budget = get_pixel_budget('L', self.max_pixels)
+        if not budget:
+            return
+        position = value.tell()
+        try:
+            width, height = BaseSizeValidator.clean(value)
+            if width * height <= budget:
+                return
+            value.seek(0)
+            with Image.open(value) as img:
+                self.attr_class.draft_image(
+                    img, list(self.variations.values()), self.max_pixels
+                )
+                budget = get_pixel_budget(img.mode, self.max_pixels)
+                size = img.size
+        except Image.DecompressionBombError:
+            size = float('inf'), 1
+        except (OSError, SyntaxError, ValueError):
+            return
+        finally:
+            value.seek(position)
+        if size[0] * size[1] > budget:
+            raise ValidationError(
+                gettext_lazy('The image you uploaded is too large to be processed.'
+                             ' The maximum is %(pixels)s pixels.'),
+                code='max_pixels', params={'pixels': budget},
+            )
 
     def save_form_data(self, instance, data):
         if self.delete_orphans and (data is False or data is not None):
@@ -308,17 +1367,19 @@ class JPEGFieldFile(StdImageFieldFile):
 
         resample = variation['resample']
 
-        if variation['width'] is None:
-            variation['width'] = image.size[0]
+        width = variation['width']
+        if width is None:
+            width = image.size[0]
 
-        if variation['height'] is None:
-            variation['height'] = image.size[1]
+        height = variation['height']
+        if height is None:
+            height = image.size[1]
 
         factor = 1
         while image.size[0] / factor \
-                > 2 * variation['width'] \
+                > 2 * width \
                 and image.size[1] * 2 / factor \
-                > 2 * variation['height']:
+                > 2 * height:
             factor *= 2
         if factor > 1:
             image.thumbnail(
@@ -327,7 +1388,7 @@ class JPEGFieldFile(StdImageFieldFile):
                 resample=resample
             )
 
-        size = variation['width'], variation['height']
+        size = width, height
         size = tuple(int(i) if i is not None else i
                      for i in size)
 
@@ -354,6 +1415,14 @@ class JPEGFieldFile(StdImageFieldFile):
 
         return image, save_kargs
 
+    @classmethod
+    def get_variation_size(cls, size, variation):
+        width = variation['width'] or size[0]
+        height = variation['height'] or size[1]
+        if variation['crop']:
+            return width, height
+        return get_thumbnail_size(size, (width, height))
+
 
 class JPEGField(StdImageField):
     attr_class = JPEGFieldFile
@@ -0,0 +1,218 @@
+"""
+Pipelined rendering of many images.
+
+Rendering an image fetches the source from the storage, resizes and encodes
+its variations, and uploads them. On remote storages most of that time is
+spent waiting for the network. :class:`RenderPipeline` runs these steps as
+separate stages connected by bounded queues, so that downloads and uploads
+overlap with rendering other images.
+"""
+import io
+import os
+import queue
+import threading
+from collections import namedtuple
+
+from django.core.files.base import ContentFile
+
+from .executors import InlineExecutor
+from .manifest import read_manifest
+from .signals import StageTimer
+
+__all__ = ('RenderPipeline', 'RenderResult')
+
+RenderResult = namedtuple('RenderResult', ('file_name', 'variations', 'error'))
+RenderResult.__doc__ = """
+Result of rendering the variations of a single image.
+
+``variations`` holds the names of the rendered variation files, which is
+empty if all variations existed already, and ``error`` the exception that
+occurred, e.g. a ``FileNotFoundError`` for a missing source image.
+"""
+
+_DONE = object()
+
+
+class BufferStorage:
+    """Collects the encoded variations of an image for the store stage."""
+
+    def __init__(self):
+        self.files = []
+
+    def save(self, name, content, max_length=None):
+        self.files.append((name, content.read()))
+        return name
+
+
+class RenderPipeline:
+    """
+    Render the variations of many images in three concurrent stages.
+
+    ``fetch`` workers check which variations need rendering and download the
+    source image, ``render`` workers decode, resize and encode the variations,
+    and ``store`` workers upload them and update the manifest. Each stage
+    hands its work to the next one through a queue of ``queue_size`` items,
+    which bounds the number of images held in memory.
+
+    Render workers are threads, since Pillow releases the GIL while decoding,
+    resizing and encoding images.
+
+    Args:
+        fetch_workers (int): Number of concurrent downloads.
+        render_workers (int): Number of concurrent renders,
+            defaults to the number of CPUs.
+        store_workers (int): Number of concurrent uploads.
+        queue_size (int): Capacity of the queues between the stages,
+            defaults to twice the number of render workers.
+
+    """
+
+    def __init__(self, field_class, variations, storage, replace=False,
+                 manifest=False, max_pixels=None, do_render=True,
+                 fetch_workers=4, render_workers=None, store_workers=4,
+                 queue_size=None):
+        self.field_class = field_class
+        self.variations = variations
+        self.storage = storage
+        self.replace = replace
+        self.manifest = manifest
+        self.max_pixels = max_pixels
+        self.do_render = do_render
+        self.fetch_workers = fetch_workers
+        self.render_workers = render_workers or os.cpu_count() or 1
+        self.store_workers = store_workers
+        self.queue_size = queue_size or 2 * self.render_workers
+
+    @classmethod
+    def from_field(cls, field, replace=False, **kwargs):
+        """Return a pipeline for the variations of a :class:`StdImageField`."""
+        return cls(
+            field.attr_class, field.variations, field.storage, replace,
+            manifest=field.manifest, max_pixels=field.max_pixels,
+            do_render=field.render_variations, **kwargs
+        )
+
+    def fetch(self, file_name):
+        """Return the pending variations and content of a source image."""
+        timer = StageTimer(self.field_class, file_name=file_name, variation=None,
+                           format=None, size=None)
+        do_render = self.do_render
+        if callable(do_render):
+            do_render = do_render(
+                file_name=file_name, variations=self.variations,
+                storage=self.storage,
+            )
+        if not do_render:
+            return RenderResult(file_name, [], None)
+        entries = read_manifest(self.storage, file_name) if self.manifest else None
+        pending = self.field_class.get_pending_variations(
+            file_name, self.variations, self.replace, self.storage, entries
+        )
+        if not pending:
+            return RenderResult(file_name, [], None)
+        with self.field_class.open_source(file_name, self.storage) as f:
+            content = f.read()
+        timer('fetch', len(content))
+        return file_name, pending, entries, content
+
+    def render(self, item):
+        """Decode a fetched source image and encode its pending variations."""
+        file_name, pending, entries, content = item
+        buffer = BufferStorage()
+        with self.field_class.open_image(
+            file_name, pending, self.storage, self.max_pixels,
+            source=io.BytesIO(content),
+        ) as img:
+            rendered, errors = self.field_class.run_variation_tasks(
+                img, pending, buffer, InlineExecutor(), file_name
+            )
+        return file_name, pending, entries, rendered, errors, buffer.files
+
+    def store(self, item):
+        """Save the encoded variations of an image and update its manifest."""
+        file_name, pending, entries, rendered, errors, files = item
+        timer = StageTimer(self.field_class, file_name=file_name, variation=None,
+                           format=None, size=None)
+        for name, content in files:
+            self.storage.save(name, ContentFile(content))
+            timer('store', len(content))
+        variations = self.field_class.finish_render(
+            file_name, pending, rendered, errors, self.storage, entries
+        )
+        return RenderResult(file_name, variations, None)
+
+    def run(self, file_names, on_result=None):
+        """
+        Render the variations of all images and return their results.
+
+        File names are consumed lazily by the calling thread, which also
+        calls ``on_result`` with every :class:`RenderResult`. Errors of
+        single images are reported, rather than raised. Should ``on_result``
+        raise an exception, the pipeline is stopped and the exception is
+        raised once all running stages have finished.
+
+        Returns:
+            list: :class:`RenderResult` of every image, in order of completion.
+
+        """
+        stop = threading.Event()
+        results_queue = queue.Queue()
+        inboxes = [queue.Queue(self.queue_size) for _ in range(3)]
+        stages = [
+            (self.fetch, inboxes[0], inboxes[1], self.fetch_workers),
+            (self.render, inboxes[1], inboxes[2], self.render_workers),
+            (self.store, inboxes[2], results_queue, self.store_workers),
+        ]
+
+        def work(stage, inbox, outbox):
+            while True:
+                item = inbox.get()
+                if item is _DONE:
+                    return
+                if stop.is_set():
+                    continue
+                file_name = item if isinstance(item, str) else item[0]
+                try:
+                    item = stage(item)
+                except Exception as e:
+                    item = RenderResult(file_name, [], e)
+                if isinstance(item, RenderResult):
+                    results_queue.put(item)
+                else:
+                    outbox.put(item)
+
+        workers = [
+            [threading.Thread(target=work, args=(stage, inbox, outbox), daemon=True)
+             for _ in range(count)]
+            for stage, inbox, outbox, count in stages
+        ]
+        for thread in (thread for threads in workers for thread in threads):
+            thread.start()
+
+        results = []
+
+        def deliver():
+            while True:
+                try:
+                    result = results_queue.get(block=False)
+                except queue.Empty:
+                    return
+                results.append(result)
+                if on_result is not None:
+                    on_result(result)
+
+        try:
+            for file_name in file_names:
+                inboxes[0].put(file_name)
+                deliver()
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            for (_, inbox, _, _), threads in zip(stages, workers):
+                for _ in threads:
+                    inbox.put(_DONE)
+                for thread in threads:
+                    thread.join()
+        deliver()
+        return results
@@ -0,0 +1,277 @@
+"""Queues to render variations outside of the request."""
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.storage import Storage
+from django.utils.module_loading import import_string
+
+from .files import get_private_dir
+
+__all__ = ('RenderQueue', 'FileRenderQueue', 'get_queue')
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def _get_storage(path, arguments):
+    storage_class = import_string(path)
+    if not isinstance(storage_class, type) or not issubclass(storage_class, Storage):
+        msg = '"storage" expects the import path of a Storage class, but got %r' % path
+        raise ValueError(msg)
+    args, kwargs = json.loads(arguments)
+    return storage_class(*args, **kwargs)
+
+
+class RenderQueue:
+    """
+    Base class for queues that defer the rendering of variations.
+
+    Jobs are plain JSON serializable dictionaries. Subclasses implement
+    :meth:`put` to store a job and call :meth:`run` once it is due,
+    e.g. from a Celery task.
+    """
+
+    def enqueue(self, field_class, file_name, variations, replace, storage,
+                manifest=False, max_pixels=None, source_digest=None):
+        """Add a render job for all variations of a file to the queue."""
+        path, args, kwargs = storage.deconstruct()
+        job = {
+            'field_class': '%s.%s' % (field_class.__module__,
+                                      field_class.__qualname__),
+            'file_name': file_name,
+            'variations': variations,
+            'replace': replace,
+            'manifest': manifest,
+            'max_pixels': max_pixels,
+            'source_digest': source_digest,
+            'storage': [path, json.dumps([args, kwargs], default=str)],
+        }
+        job['key'] = self.get_key(job)
+        self.put(job)
+        return job
+
+    @staticmethod
+    def get_key(job):
+        """Return the key of a job, jobs for the same file share the same key."""
+        key = '%s:%s' % (job['storage'][0], job['file_name'])
+        return hashlib.sha1(key.encode()).hexdigest()  # nosec
+
+    def put(self, job):
+        raise NotImplementedError
+
+    @staticmethod
+    def run(job):
+        """Render all variations of a job and return the rendered file names."""
+        from .models import StdImageFieldFile
+
+        field_class = import_string(job['field_class'])
+        if not isinstance(field_class, type) \
+                or not issubclass(field_class, StdImageFieldFile):
+            msg = ('"field_class" expects the import path of a StdImageFieldFile'
+                   ' subclass, but got %r') % job['field_class']
+            raise ValueError(msg)
+        storage = _get_storage(*job['storage'])
+        return field_class.render_all_variations(
+            job['file_name'], job['variations'], job['replace'], storage,
+            executor='inline', manifest=job.get('manifest', False),
+            max_pixels=job.get('max_pixels'),
+            source_digest=job.get('source_digest'),
+        )
+
+
+class FileRenderQueue(RenderQueue):
+    """
+    Render queue backed by JSON files in a local directory.
+
+    A new job replaces any pending job for the same file. Failed jobs are
+    retried with exponential backoff, and moved to the ``failed`` directory
+    after ``max_attempts`` attempts. Jobs of workers that did not finish
+    within ``timeout`` seconds, e.g. because the worker was killed, are
+    retried as well.
+
+    Args:
+        path (str):
+            Queue directory. Defaults to the ``STDIMAGE_QUEUE_DIR`` setting,
+            or a directory in the system's temporary directory that is only
+            accessible by the current user.
+        max_attempts (int):
+            Number of attempts before a job is considered failed.
+        backoff (int):
+            Seconds to wait before the first retry, doubled on every attempt.
+        timeout (int):
+            Seconds after which a running job is considered abandoned.
+
+    """
+
+    def __init__(self, path=None, max_attempts=5, backoff=60, timeout=600):
+        self.path = path or getattr(settings, 'STDIMAGE_QUEUE_DIR', None) \
+            or get_private_dir('stdimage-queue')
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def _get_path(self, state, key):
+        directory = os.path.join(self.path, state)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, '%s.json' % key)
+
+    @staticmethod
+    def _write(path, job):
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
+
+    def put(self, job):
+        job.setdefault('attempts', 0)
+        job.setdefault('not_before', 0)
+        self._write(self._get_path('pending', job['key']), job)
+
+    def pending(self):
+        """Return all pending jobs, oldest first."""
+        directory = os.path.dirname(self._get_path('pending', ''))
+        jobs = []
+        for entry in sorted(os.scandir(directory),
+                            key=lambda e: e.stat().st_mtime):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path) as f:
+                    jobs.append(json.load(f))
+            except FileNotFoundError:
+                pass
+        return jobs
+
+    def claim(self):
+        """
+        Return the next due job and mark it as running, or ``None``.
+
+        Only one job per file runs at a time. The ``running`` marker is
+        created exclusively, before the pending job is moved onto it.
+        """
+        self.reclaim()
+        now = time.time()
+        for job in self.pending():
+            if job['not_before'] > now:
+                continue
+            running_path = self._get_path('running', job['key'])
+            try:
+                os.close(os.open(running_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except FileExistsError:
+                continue  # a job for the same file is running
+            try:
+                os.replace(self._get_path('pending', job['key']), running_path)
+                with open(running_path) as f:
+                    job = json.load(f)
+            except FileNotFoundError:
+                os.remove(running_path)
+                continue
+            job['claim'] = uuid.uuid4().hex
+            self._write(running_path, job)
+            return job
+
+    def reclaim(self):
+        """Retry running jobs that exceeded the timeout."""
+        directory = os.path.dirname(self._get_path('running', ''))
+        deadline = time.time() - self.timeout
+        for entry in os.scandir(directory):
+            if not entry.name.endswith('.json'):
+                continue
+            stale_path = '%s.%d.stale' % (entry.path, os.getpid())
+            try:
+                if entry.stat().st_mtime > deadline:
+                    continue
+                os.rename(entry.path, stale_path)
+            except FileNotFoundError:
+                continue  # finished or reclaimed by another worker
+            try:
+                with open(stale_path) as f:
+                    job = json.load(f)
+            except ValueError:
+                pass  # the claiming worker died before moving the job
+            else:
+                logger.warning('Rendering variations of "%s" timed out.',
+                               job['file_name'])
+                self._retry(job)
+            os.remove(stale_path)
+
+    def _retry(self, job):
+        job.pop('claim', None)
+        job['attempts'] += 1
+        if job['attempts'] >= self.max_attempts:
+            self._write(self._get_path('failed', job['key']), job)
+        elif not os.path.exists(self._get_path('pending', job['key'])):
+            job['not_before'] = time.time() + \
+                self.backoff * 2 ** (job['attempts'] - 1)
+            self._write(self._get_path('pending', job['key']), job)
+
+    def _release(self, job):
+        """Remove the running marker of a job, unless it has been reclaimed."""
+        running_path = self._get_path('running', job['key'])
+        try:
+            with open(running_path) as f:
+                if json.load(f).get('claim') != job['claim']:
+                    return False
+            os.remove(running_path)
+        except (FileNotFoundError, ValueError):
+            return False
+        return True
+
+    def process(self, job):
+        """Run a claimed job and schedule a retry should it fail."""
+        try:
+            self.run(job)
+        except Exception:
+            logger.exception('Failed to render variations of "%s".', job['file_name'])
+            if self._release(job):
+                self._retry(job)
+            return False
+        self._release(job)
+        return True
+
+    def work(self, burst=False, interval=1):
+        """
+        Process jobs until the queue is empty or forever.
+
+        Args:
+            burst (bool): Return once no job is due, instead of polling.
+            interval (float): Seconds to wait between polls.
+
+        Returns:
+            int: Number of successfully processed jobs.
+
+        """
+        processed = 0
+        while True:
+            job = self.claim()
+            if job is None:
+                if burst:
+                    return processed
+                time.sleep(interval)
+                continue
+            processed += self.process(job)
+
+
+def get_queue(queue=None):
+    """
+    Return a render queue instance.
+
+    Args:
+        queue (str, RenderQueue):
+            A queue instance or the import path of a queue class.
+            Defaults to the ``STDIMAGE_RENDER_QUEUE`` setting,
+            which defaults to :class:`FileRenderQueue`.
+
+    """
+    if queue is None:
+        queue = getattr(settings, 'STDIMAGE_RENDER_QUEUE',
+                        'stdimage.queue.FileRenderQueue')
+    if isinstance(queue, str):
+        queue = import_string(queue)()
+    return queue
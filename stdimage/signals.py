@@ -0,0 +1,76 @@
+"""Signals sent while variations are rendered."""
+import sys
+import time
+
+from django.dispatch import Signal
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+__all__ = ('render_stage', 'StageTimer', 'get_max_rss')
+
+#: Sent after each stage of rendering variations.
+#:
+#: Arguments sent with this signal:
+#:
+#: ``sender``
+#:     The field file class, e.g. :class:`stdimage.models.StdImageFieldFile`.
+#: ``stage``
+#:     ``"open"``, ``"decode"``, ``"process"``, ``"encode"`` or ``"save"``.
+#:     :class:`stdimage.pipeline.RenderPipeline` also sends ``"fetch"``, once
+#:     a source image is downloaded, and ``"store"`` for every uploaded file,
+#:     while its ``"save"`` stage only buffers the encoded file.
+#: ``duration``
+#:     Wall time of the stage in seconds.
+#: ``bytes``
+#:     Bytes read by ``"fetch"`` and ``"decode"`` or written by ``"encode"``,
+#:     ``"save"`` and ``"store"``, otherwise ``None``.
+#: ``file_name``
+#:     Name of the source image.
+#: ``variation``
+#:     Name of the variation, ``None`` for stages of the source image.
+#: ``format``, ``size``
+#:     Format and decoded dimensions of the source image, ``None`` before
+#:     decoding. JPEGs may be decoded at a reduced size, see
+#:     :meth:`stdimage.models.StdImageFieldFile.draft_image`.
+#: ``max_rss``
+#:     Peak resident set size of the process in bytes since it started,
+#:     see :func:`get_max_rss`. It is not reset between renders, thus it
+#:     does not measure the memory used by a single image.
+#:
+#: Stages of variations rendered by a process pool are sent in the
+#: worker processes.
+render_stage = Signal()
+
+
+def get_max_rss():
+    """
+    Return the peak resident set size of the process in bytes, if available.
+
+    The peak is measured over the lifetime of the process.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class StageTimer:
+    """Send a :data:`render_stage` signal for each of consecutive stages."""
+
+    def __init__(self, sender, **event):
+        self.sender = sender
+        self.event = event
+        self.start = time.perf_counter()
+
+    def __call__(self, stage, bytes=None, **event):
+        """Send the duration since the previous stage and start the next one."""
+        now = time.perf_counter()
+        if render_stage.receivers:
+            render_stage.send(
+                self.sender, stage=stage, duration=now - self.start,
+                bytes=bytes, max_rss=get_max_rss(), **dict(self.event, **event)
+            )
+        self.start = time.perf_counter()
@@ -0,0 +1,117 @@
+"""Helpers to reduce the number of round trips to remote storages."""
+import os
+import weakref
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.encoding import filepath_to_uri
+
+__all__ = ('existing_files', 'delete_files', 'get_url_prefix', 'get_urls')
+
+_url_prefixes = weakref.WeakKeyDictionary()
+_probe_names = ('stdimage-probe.jpg', 'stdimage probe/\u00e4.jpg')
+
+
+def existing_files(storage, names):
+    """
+    Return the subset of ``names`` that exist in the storage.
+
+    Storages may implement an ``exists_many(names)`` method to answer the
+    query in a single request. Otherwise ``exists`` is called for every file.
+
+    With the ``STDIMAGE_EXISTS_LISTDIR`` setting, each directory is listed
+    once instead. This only pays off if directories hold few files, e.g. one
+    directory per image, since listing a directory of a remote storage
+    fetches every file name in it. Local file systems and storages that do
+    not support ``listdir`` always fall back to ``exists``.
+    """
+    names = list(names)
+    if not names:
+        return set()
+    if hasattr(storage, 'exists_many'):
+        return set(storage.exists_many(names))
+    if not getattr(settings, 'STDIMAGE_EXISTS_LISTDIR', False) \
+            or isinstance(storage, FileSystemStorage) or len(names) == 1:
+        return {name for name in names if storage.exists(name)}
+
+    directories = defaultdict(list)
+    for name in names:
+        directories[os.path.dirname(name)].append(name)
+
+    existing = set()
+    for directory, dir_names in directories.items():
+        try:
+            _, files = storage.listdir(directory)
+        except NotImplementedError:
+            existing.update(name for name in dir_names if storage.exists(name))
+        except FileNotFoundError:
+            pass
+        else:
+            files = set(files)
+            existing.update(
+                name for name in dir_names if os.path.basename(name) in files
+            )
+    return existing
+
+
+def delete_files(storage, names):
+    """
+    Delete all ``names`` from the storage.
+
+    Storages may implement a ``delete_many(names)`` method to delete all
+    files in a single request, otherwise ``delete`` is called for each file.
+    """
+    names = list(names)
+    if not names:
+        return
+    if hasattr(storage, 'delete_many'):
+        storage.delete_many(names)
+    else:
+        for name in names:
+            storage.delete(name)
+
+
+def get_url_prefix(storage):
+    """
+    Return the prefix shared by all URLs of the storage, or ``None``.
+
+    The storage is probed once per process: if the URLs of the probe names
+    are a common prefix followed by the quoted name, URLs are built by
+    concatenation instead of calling ``url`` for every file. Storages that
+    sign URLs, or quote names differently, return ``None``.
+    """
+    try:
+        return _url_prefixes[storage]
+    except KeyError:
+        pass
+    except TypeError:
+        return None
+    urls = [storage.url(name) for name in _probe_names]
+    paths = [filepath_to_uri(name) for name in _probe_names]
+    prefix = None
+    if urls[0].endswith(paths[0]):
+        prefix = urls[0][:-len(paths[0])]
+        if urls[1] != prefix + paths[1]:
+            prefix = None
+    _url_prefixes[storage] = prefix
+    return prefix
+
+
+def get_urls(storage, names):
+    """
+    Return the URLs of all ``names`` in the storage.
+
+    Storages may implement a ``url_many(names)`` method to build or sign
+    all URLs in a single call. Otherwise the memoized prefix of the storage
+    is used, see :func:`get_url_prefix`, or ``url`` is called for each file.
+    """
+    names = list(names)
+    if not names:
+        return []
+    if hasattr(storage, 'url_many'):
+        return list(storage.url_many(names))
+    prefix = get_url_prefix(storage)
+    if prefix is None:
+        return [storage.url(name) for name in names]
+    return [prefix + filepath_to_uri(name).lstrip('/') for name in names]
@@ -0,0 +1,22 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag
+def srcset(field_file, *variations):
+    """
+    Return the ``srcset`` attribute of the variations of an image.
+
+    Usage::
+
+        {% load stdimage %}
+        <img src="{{ object.image.url }}" srcset="{% srcset object.image %}"
+             sizes="(max-width: 600px) 100vw, 50vw">
+
+    Pass variation names to limit the candidates, e.g.
+    ``{% srcset object.image "thumbnail" "medium" %}``.
+    """
+    if not field_file:
+        return ''
+    return field_file.srcset(list(variations) or None)
@@ -1,12 +1,163 @@
+import json
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
 from django.core.files.storage import default_storage
+from django.db.models import QuerySet
 
+from .executors import get_executor
+from .metrics import RenderStats
 from .models import StdImageFieldFile
+from .pipeline import RenderPipeline, RenderResult
+from .queue import RenderQueue, _get_storage
+
+__all__ = (
+    'render_variations', 'arender_variations', 'render_variations_bulk',
+    'RenderResult',
+)
 
 
 def render_variations(file_name, variations, replace=False,
-                      storage=default_storage, field_class=StdImageFieldFile):
+                      storage=default_storage, field_class=StdImageFieldFile,
+                      executor=None, manifest=False, max_pixels=None):
     """Render all variations for a given field."""
-    for key, variation in variations.items():
-        field_class.render_variation(
-            file_name, variation, replace, storage
+    field_class.render_all_variations(
+        file_name, variations, replace, storage, executor=executor,
+        manifest=manifest, max_pixels=max_pixels,
+    )
+
+
+async def arender_variations(file_name, variations, replace=False,
+                             storage=default_storage, field_class=StdImageFieldFile,
+                             executor=None, manifest=False, max_pixels=None):
+    """Render all variations for a given field without blocking the event loop."""
+    await field_class.arender_all_variations(
+        file_name, variations, replace, storage, executor=executor,
+        manifest=manifest, max_pixels=max_pixels,
+    )
+
+
+def render_file(file_name, field_class, variations, replace, storage, do_render,
+                manifest=False, max_pixels=None, stats=False):
+    """
+    Render the variations of a single image of a bulk render.
+
+    The function is defined on module level to be picklable for process pools,
+    which receive the ``storage`` as its deconstructed import path and arguments.
+
+    Returns:
+        tuple: The :class:`RenderResult` and the image's
+        :class:`stdimage.metrics.RenderStats`, if ``stats`` is ``True``.
+
+    """
+    if stats:
+        with RenderStats(file_name=file_name) as file_stats:
+            result, _ = render_file(file_name, field_class, variations, replace,
+                                    storage, do_render, manifest, max_pixels)
+        return result, file_stats
+    if isinstance(storage, tuple):
+        storage = _get_storage(*storage)
+    try:
+        if callable(do_render):
+            do_render = do_render(
+                file_name=file_name, variations=variations, storage=storage,
+            )
+        rendered = []
+        if do_render:
+            rendered = field_class.render_all_variations(
+                file_name, variations, replace, storage, executor='inline',
+                manifest=manifest, max_pixels=max_pixels,
+            )
+    except Exception as e:
+        return RenderResult(file_name, [], e), None
+    return RenderResult(file_name, rendered, None), None
+
+
+def render_variations_bulk(files, field, replace=False, executor=None,
+                           max_pending=8, stats=None, on_result=None,
+                           pipeline=None):
+    """
+    Render the variations of many images of a field, e.g. in data migrations.
+
+    Images are rendered concurrently by the executor, at most ``max_pending``
+    at a time, while the next file names are fetched lazily. Thread pools
+    overlap fetching the source of one image with resizing another.
+    Errors of single images are reported, rather than raised.
+
+    Args:
+        files (QuerySet, list):
+            A queryset of model instances or an iterable of file names.
+        field (StdImageField, str):
+            The image field, or its name if ``files`` is a queryset.
+        executor (str, concurrent.futures.Executor):
+            ``"inline"``, ``"thread"``, ``"process"`` or an executor instance,
+            see :func:`stdimage.executors.get_executor`. Variations of a single
+            image are rendered in the executor's worker. Render queues are not
+            supported, a ``STDIMAGE_RENDER_EXECUTOR`` setting of ``"queue"``
+            renders inline.
+        stats (stdimage.metrics.RenderStats):
+            Collects the render stages of all images, including those
+            rendered by worker processes.
+        on_result (callable): Called with each :class:`RenderResult`.
+        pipeline (bool, dict):
+            Render with a :class:`stdimage.pipeline.RenderPipeline` instead
+            of the executor, which fetches sources and stores variations
+            concurrently to rendering. A dict holds the keyword arguments
+            of the pipeline, e.g. ``{'fetch_workers': 8}``.
+
+    Returns:
+        list: :class:`RenderResult` of every image, in order of completion.
+        Images completed at the same time are ordered as given.
+
+    """
+    if isinstance(files, QuerySet):
+        if isinstance(field, str):
+            field = files.model._meta.get_field(field)
+        files = files.exclude(**{'%s__isnull' % field.name: True}) \
+            .exclude(**{field.name: ''}) \
+            .values_list(field.name, flat=True).iterator()
+    if pipeline:
+        pipeline = RenderPipeline.from_field(
+            field, replace, **(pipeline if isinstance(pipeline, dict) else {})
         )
+        if stats is None:
+            return pipeline.run(files, on_result)
+        with RenderStats() as pipeline_stats:
+            results = pipeline.run(files, on_result)
+        stats.merge(pipeline_stats)
+        return results
+
+    render_executor = get_executor(executor)
+    if isinstance(render_executor, RenderQueue):
+        if executor is not None:
+            raise ValueError(
+                'Render queues do not report results, use "inline", "thread", '
+                '"process" or an Executor instance to render in bulk.'
+            )
+        render_executor = get_executor('inline')
+    executor = render_executor
+    storage = field.storage
+    if isinstance(executor, ProcessPoolExecutor):
+        path, args, kwargs = storage.deconstruct()
+        storage = path, json.dumps([args, kwargs], default=str)
+
+    results, futures = [], {}
+
+    def collect(done):
+        for future in sorted(done, key=futures.pop):
+            result, file_stats = future.result()
+            if file_stats is not None:
+                stats.merge(file_stats)
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+
+    for i, file_name in enumerate(files):
+        if len(futures) >= max_pending:
+            collect(wait(futures, return_when=FIRST_COMPLETED).done)
+        futures[executor.submit(
+            render_file, file_name, field.attr_class, field.variations, replace,
+            storage, field.render_variations, field.manifest, field.max_pixels,
+            stats is not None,
+        )] = i
+    collect(wait(futures).done)
+    return results
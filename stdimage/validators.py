@@ -1,5 +1,3 @@
-from io import BytesIO
-
 from django.core.exceptions import ValidationError
 from django.core.validators import BaseValidator
 from django.utils.translation import gettext_lazy as _
@@ -26,10 +24,26 @@ class BaseSizeValidator(BaseValidator):
 
     @staticmethod
     def clean(value):
-        value.seek(0)
-        stream = BytesIO(value.read())
-        size = Image.open(stream).size
-        value.seek(0)
+        """
+        Return the dimensions of an image file.
+
+        Only the image header is parsed, the file is read in place and never
+        copied into memory. The result is cached in the file's
+        ``_dimensions_cache`` attribute, which is shared with Django's
+        ``ImageFieldFile`` and all other size validators.
+        """
+        size = getattr(value, '_dimensions_cache', None)
+        if size is None or None in size:
+            image = getattr(value, 'image', None)
+            if isinstance(image, Image.Image):
+                size = image.size
+            else:
+                position = value.tell()
+                value.seek(0)
+                with Image.open(value) as img:
+                    size = img.size
+                value.seek(position)
+            value._dimensions_cache = size
         return size
 
 
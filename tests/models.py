@@ -190,3 +190,59 @@ class CustomRenderVariationsModel(models.Model):
         variations={'thumbnail': (150, 150)},
         render_variations=custom_render_variations,
     )
+
+
+class QueuedVariationsModel(models.Model):
+    """defers rendering of variations to the render queue"""
+    image = StdImageField(
+        upload_to=upload_to,
+        variations={'thumbnail': (150, 150, True)},
+        render_executor='queue',
+    )
+
+
+class OnDemandModel(models.Model):
+    """renders variations on first access"""
+    image = StdImageField(
+        upload_to=upload_to,
+        variations={'thumbnail': (100, 75), 'medium': (400, 400)},
+        render_on_demand=True,
+    )
+
+
+class ManifestModel(models.Model):
+    """records rendered variations in a manifest"""
+    image = StdImageField(
+        upload_to=upload_to,
+        variations={'thumbnail': (100, 75), 'medium': (400, 400)},
+        manifest=True,
+        delete_orphans=True,
+    )
+
+
+class FormatsModel(models.Model):
+    """saves variations in additional formats"""
+    image = StdImageField(
+        upload_to=upload_to,
+        variations={
+            'thumbnail': (100, 75),
+            'medium': {
+                'width': 400, 'height': 400, 'formats': {'webp': {'quality': 50}},
+            },
+        },
+        formats=['webp', 'png'],
+        delete_orphans=True,
+    )
+
+
+class DimensionsModel(models.Model):
+    """stores the dimensions of the original image"""
+    image = StdImageField(
+        upload_to=upload_to,
+        variations={'thumbnail': (100, 75), 'square': (50, 50, True)},
+        width_field='width',
+        height_field='height',
+        delete_orphans=True,
+    )
+    width = models.PositiveIntegerField(null=True)
+    height = models.PositiveIntegerField(null=True)
@@ -1,5 +1,52 @@
-from django.core.files.storage import FileSystemStorage
+import os
+from collections import Counter
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, Storage
 
 
 class MyFileSystemStorage(FileSystemStorage):
     pass
+
+
+class MemoryStorage(Storage):
+    """Remote storage stand-in, that counts the calls of every method."""
+
+    def __init__(self):
+        self.files = {}
+        self.calls = Counter()
+
+    def _open(self, name, mode='rb'):
+        self.calls['open'] += 1
+        return ContentFile(self.files[name], name=name)
+
+    def _save(self, name, content):
+        self.calls['save'] += 1
+        content.seek(0)
+        self.files[name] = content.read()
+        return name
+
+    def exists(self, name):
+        self.calls['exists'] += 1
+        return name in self.files
+
+    def delete(self, name):
+        self.calls['delete'] += 1
+        self.files.pop(name, None)
+
+    def listdir(self, path):
+        self.calls['listdir'] += 1
+        path = path.rstrip('/')
+        files = [
+            os.path.basename(name) for name in self.files
+            if os.path.dirname(name) == path
+        ]
+        return [], files
+
+    def size(self, name):
+        self.calls['size'] += 1
+        return len(self.files[name])
+
+    def url(self, name):
+        self.calls['url'] += 1
+        return 'https://example.com/%s' % name
@@ -0,0 +1,266 @@
+import asyncio
+import io
+import os
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from PIL import Image
+
+from stdimage.cache import (DjangoRenderCache, LocalRenderCache, LocalSourceCache,
+                            get_cache_key, get_digest, get_render_cache,
+                            get_source_cache, get_source_key,)
+from stdimage.models import JPEGFieldFile, StdImageFieldFile
+from tests.models import FormatsModel, ResizeModel, ThumbnailModel
+from tests.storage import MemoryStorage
+from tests.test_models import IMG_DIR, TestStdImage
+
+
+def test_get_digest():
+    assert get_digest(ContentFile(b'foo')) == (
+        '2c26b46b68ffc68ff99b453c1d30413413422d706483bfa0f98a5e886266e7ae'
+    )
+
+
+def test_get_cache_key():
+    variation = ThumbnailModel._meta.get_field('image').variations['thumbnail']
+    key = get_cache_key('abc', StdImageFieldFile, variation)
+    assert len(key) == 64
+    assert key == get_cache_key('abc', StdImageFieldFile, variation)
+    assert key != get_cache_key('abd', StdImageFieldFile, variation)
+    assert key != get_cache_key('abc', JPEGFieldFile, variation)
+    assert key != get_cache_key('abc', StdImageFieldFile, variation, 'webp')
+    assert key != get_cache_key(
+        'abc', StdImageFieldFile, dict(variation, width=200)
+    )
+
+
+def test_get_source_key(tmp_path):
+    storage = FileSystemStorage(str(tmp_path))
+    key = get_source_key(storage, 'img/a.jpg')
+    assert len(key) == 64
+    assert key == get_source_key(FileSystemStorage(str(tmp_path)), 'img/a.jpg')
+    assert key != get_source_key(storage, 'img/b.jpg')
+    assert key != get_source_key(FileSystemStorage(str(tmp_path / 'b')), 'img/a.jpg')
+    assert get_source_key(MemoryStorage(), 'img/a.jpg') != key
+
+
+class TestLocalRenderCache:
+    def test_get_set(self, tmp_path):
+        cache = LocalRenderCache(str(tmp_path))
+        assert cache.get('a') is None
+        cache.set('a', b'foo')
+        assert cache.get('a') == b'foo'
+        assert cache.get_many(['a', 'b']) == {'a': b'foo'}
+        assert LocalRenderCache(str(tmp_path)).get('a') == b'foo'
+
+    def test_eviction(self, tmp_path):
+        cache = LocalRenderCache(str(tmp_path), max_size=6)
+        cache.set('a', b'aa')
+        cache.set('b', b'bb')
+        cache.set('c', b'cc')
+        assert cache.get('a') == b'aa'
+        cache.set('d', b'dd')
+        assert cache.get('b') is None
+        assert sorted(os.listdir(str(tmp_path))) == ['a', 'c', 'd']
+
+    def test_index(self, tmp_path):
+        LocalRenderCache(str(tmp_path)).set('a', b'aaaa')
+        cache = LocalRenderCache(str(tmp_path), max_size=6)
+        cache.set('b', b'bbbb')
+        assert sorted(os.listdir(str(tmp_path))) == ['b']
+
+    def test_rescan(self, tmp_path):
+        cache = LocalRenderCache(str(tmp_path), max_size=6)
+        cache.set('a', b'aa')
+        other = LocalRenderCache(str(tmp_path), max_size=6)
+        other.set('b', b'bb')
+        other.set('c', b'cc')
+        cache.set('d', b'dd')
+        assert len(os.listdir(str(tmp_path))) == 4
+        cache.scan_interval = 0
+        cache.set('e', b'ee')
+        assert len(os.listdir(str(tmp_path))) == 3
+
+    def test_default_path(self, settings, monkeypatch, tmp_path):
+        monkeypatch.setattr('tempfile.gettempdir', lambda: str(tmp_path))
+        settings.STDIMAGE_RENDER_CACHE_DIR = None
+        cache = LocalRenderCache()
+        assert os.path.dirname(cache.path) == str(tmp_path)
+        assert os.stat(cache.path).st_mode & 0o777 == 0o700
+
+    def test_delete(self, tmp_path):
+        cache = LocalRenderCache(str(tmp_path))
+        cache.set('a', b'aa')
+        cache.delete('a')
+        cache.delete('b')
+        assert cache.get('a') is None
+        assert cache._total == 0
+
+    def test_deleted_file(self, tmp_path):
+        cache = LocalRenderCache(str(tmp_path))
+        cache.set('a', b'aa')
+        os.remove(str(tmp_path / 'a'))
+        assert cache.get('a') is None
+        assert cache._total == 0
+
+
+class TestDjangoRenderCache:
+    def test_get_set(self):
+        cache = DjangoRenderCache()
+        assert cache.get('a') is None
+        cache.set('a', b'foo')
+        assert cache.get('a') == b'foo'
+        assert cache.get_many(['a', 'b']) == {'a': b'foo'}
+        assert cache.cache.get('stdimage:a') == b'foo'
+        cache.delete('a')
+        assert cache.get('a') is None
+
+
+class TestGetRenderCache:
+    def test_default(self):
+        assert get_render_cache() is None
+
+    def test_instance(self, settings, tmp_path):
+        cache = LocalRenderCache(str(tmp_path))
+        settings.STDIMAGE_RENDER_CACHE = cache
+        assert get_render_cache() is cache
+
+    def test_import_path(self):
+        cache = get_render_cache('stdimage.cache.DjangoRenderCache')
+        assert isinstance(cache, DjangoRenderCache)
+        assert get_render_cache('stdimage.cache.DjangoRenderCache') is cache
+
+
+class TestRenderCache(TestStdImage):
+    @pytest.fixture(autouse=True)
+    def render_cache(self, settings, tmp_path):
+        cache = LocalRenderCache(str(tmp_path))
+        settings.STDIMAGE_RENDER_CACHE = cache
+        return cache
+
+    def read(self, name):
+        with open(os.path.join(IMG_DIR, name), 'rb') as f:
+            return f.read()
+
+    def test_save(self, db, monkeypatch, render_cache):
+        first = FormatsModel.objects.create(image=self.fixtures['600x400.jpg'])
+        assert len(os.listdir(render_cache.path)) == 5
+
+        def fail(*args, **kwargs):
+            pytest.fail('source was decoded')
+
+        monkeypatch.setattr(StdImageFieldFile, 'open_image', fail)
+        second = FormatsModel.objects.create(image=self.fixtures['600x400.jpg'])
+        assert second.image.name != first.image.name
+        for variation in ('thumbnail', 'medium'):
+            first_file = getattr(first.image, variation)
+            second_file = getattr(second.image, variation)
+            with first_file.open() as a, second_file.open() as b:
+                assert a.read() == b.read()
+            with first_file.webp.open() as a, second_file.webp.open() as b:
+                assert a.read() == b.read()
+        assert second.image.thumbnail.width == 100
+
+    def test_save__different_source(self, db, render_cache):
+        FormatsModel.objects.create(image=self.fixtures['600x400.jpg'])
+        FormatsModel.objects.create(image=self.fixtures['100.gif'])
+        assert len(os.listdir(render_cache.path)) == 10
+
+    def test_missing_sibling(self, db, render_cache):
+        instance = FormatsModel.objects.create(image=self.fixtures['600x400.jpg'])
+        variation = instance.image.field.variations['thumbnail']
+        os.remove(os.path.join(render_cache.path, get_cache_key(
+            get_digest(self.fixtures['600x400.jpg']), StdImageFieldFile,
+            variation, 'png',
+        )))
+        instance.image.delete_variations()
+        remaining, restored = StdImageFieldFile.restore_variations(
+            get_digest(self.fixtures['600x400.jpg']),
+            [(v, instance.image.get_variation_name(instance.image.name, name))
+             for name, v in instance.image.field.variations.items()],
+            instance.image.storage,
+        )
+        assert [v['name'] for v, _ in remaining] == ['thumbnail']
+        assert restored == {
+            'medium': {'width': 400, 'height': 267, 'size': restored['medium']['size']}
+        }
+        assert os.path.exists(os.path.join(IMG_DIR, '600x400.medium.webp'))
+        assert not os.path.exists(os.path.join(IMG_DIR, '600x400.thumbnail.jpg'))
+
+    def test_arender_variations(self, db, monkeypatch):
+        instance = FormatsModel.objects.create(image=self.fixtures['600x400.jpg'])
+        thumbnail = self.read('600x400.thumbnail.jpg')
+        instance.image.delete_variations()
+        monkeypatch.setattr(StdImageFieldFile, 'open_image', None)
+        asyncio.run(instance.image.arender_variations(
+            source_digest=get_digest(self.fixtures['600x400.jpg'])
+        ))
+        assert self.read('600x400.thumbnail.jpg') == thumbnail
+
+    def test_render_on_demand(self, db, render_cache, monkeypatch):
+        monkeypatch.setattr(
+            FormatsModel._meta.get_field('image'), 'render_on_demand', True
+        )
+        FormatsModel.objects.create(image=self.fixtures['600x400.jpg'])
+        assert os.listdir(render_cache.path) == []
+
+
+class TestSourceCache(TestStdImage):
+    @pytest.fixture(autouse=True)
+    def source_cache(self, settings, tmp_path):
+        cache = LocalSourceCache(str(tmp_path))
+        settings.STDIMAGE_SOURCE_CACHE = cache
+        return cache
+
+    def test_default(self, settings):
+        del settings.STDIMAGE_SOURCE_CACHE
+        assert get_source_cache() is None
+
+    def test_local_source_cache(self, settings, tmp_path):
+        settings.STDIMAGE_SOURCE_CACHE_DIR = str(tmp_path / 'sources')
+        cache = LocalSourceCache()
+        assert cache.path == str(tmp_path / 'sources')
+        assert cache.max_size == 1024 * 1024 * 1024
+
+    def test_local_source_cache__default_path(self, settings, monkeypatch,
+                                              tmp_path):
+        monkeypatch.setattr('tempfile.gettempdir', lambda: str(tmp_path))
+        settings.STDIMAGE_SOURCE_CACHE_DIR = None
+        cache = LocalSourceCache()
+        assert os.path.basename(cache.path).startswith('stdimage-sources')
+        assert os.stat(cache.path).st_mode & 0o777 == 0o700
+
+    def test_render_variation(self, source_cache):
+        storage = MemoryStorage()
+        with io.BytesIO() as f:
+            Image.new('RGB', (600, 400), (255, 55, 255)).save(f, 'JPEG')
+            storage.save('img/image.jpg', f)
+        storage.calls.clear()
+        variations = ResizeModel._meta.get_field('image').variations
+        for variation in variations.values():
+            StdImageFieldFile.render_variation(
+                'img/image.jpg', variation, storage=storage
+            )
+        assert storage.calls['open'] == 1
+        assert storage.calls['save'] == 2
+        assert source_cache.get(get_source_key(storage, 'img/image.jpg')) == \
+            storage.files['img/image.jpg']
+
+    def test_delete(self, db, source_cache):
+        instance = ResizeModel.objects.create(image=self.fixtures['600x400.jpg'])
+        key = get_source_key(instance.image.storage, instance.image.name)
+        assert source_cache.get(key) is not None
+        instance.image.delete()
+        assert source_cache.get(key) is None
+
+    def test_save(self, db, source_cache):
+        instance = ResizeModel.objects.create(image=self.fixtures['600x400.jpg'])
+        name = instance.image.name
+        key = get_source_key(instance.image.storage, name)
+        source_cache.set(key, b'stale')
+        instance.image.storage.delete(name)
+        instance.image.save('600x400.jpg', self.fixtures['600x400.jpg'])
+        assert instance.image.name == name
+        with instance.image.open() as f:
+            assert source_cache.get(key) == f.read()
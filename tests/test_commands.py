@@ -1,12 +1,15 @@
 import hashlib
+import json
 import os
 import time
 from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 from django.core.management import CommandError, call_command
+from PIL import Image
 
-from tests.models import CustomRenderVariationsModel, MyStorageModel, ThumbnailModel
+from tests.models import (CustomRenderVariationsModel, ManifestModel, MyStorageModel,
+                          ResizeModel, ThumbnailModel,)
 
 
 @pytest.mark.django_db
@@ -32,6 +35,23 @@ class TestRenderVariations:
         )
         assert os.path.exists(file_path)
 
+    def test_outdated_variations(self, image_upload_file, monkeypatch):
+        obj = ManifestModel.objects.create(image=image_upload_file)
+        field = ManifestModel._meta.get_field('image')
+        thumbnail_path = obj.image.thumbnail.path
+        medium_path = obj.image.medium.path
+        before = os.path.getmtime(medium_path)
+        time.sleep(0.1)
+        monkeypatch.setitem(
+            field.variations, 'thumbnail',
+            dict(field.variations['thumbnail'], width=50, height=50),
+        )
+        call_command('rendervariations', 'tests.ManifestModel.image')
+        with obj.image.thumbnail.open() as f:
+            assert Image.open(f).size == (50, 50)
+        assert os.path.exists(thumbnail_path)
+        assert os.path.getmtime(medium_path) == before
+
     def test_multiprocessing(self, image_upload_file):
         objs = [
             ThumbnailModel.objects.create(
@@ -52,6 +72,255 @@ class TestRenderVariations:
         )
         assert any([os.path.exists(f) for f in file_names])
 
+    def test_workers(self, image_upload_file):
+        objs = [
+            ThumbnailModel.objects.create(
+                image=image_upload_file
+            )
+            for _ in range(10)
+        ]
+        file_names = [
+            obj.image.thumbnail.path
+            for obj in objs
+        ]
+        for obj in objs:
+            obj.image.delete_variations()
+        call_command(
+            'rendervariations',
+            'tests.ThumbnailModel.image',
+            workers=2,
+            chunk_size=3,
+        )
+        assert all([os.path.exists(f) for f in file_names])
+
+    def test_workers__invalid(self):
+        with pytest.raises(CommandError):
+            call_command(
+                'rendervariations',
+                'tests.ThumbnailModel.image',
+                workers=0,
+            )
+
+    def test_workers__no_ignore_missing(self, image_upload_file):
+        obj = ThumbnailModel.objects.create(image=image_upload_file)
+        os.remove(obj.image.path)
+        with pytest.raises(CommandError):
+            call_command(
+                'rendervariations',
+                'tests.ThumbnailModel.image',
+                '--workers=2',
+                replace=True,
+            )
+
+    def test_batch_size(self, image_upload_file, tmp_path):
+        objs = [ThumbnailModel.objects.create(image=image_upload_file)
+                for _ in range(5)]
+        for obj in objs:
+            obj.image.delete_variations()
+        call_command(
+            'rendervariations',
+            'tests.ThumbnailModel.image',
+            batch_size=2,
+            checkpoint=str(tmp_path / 'checkpoint.json'),
+        )
+        assert all(os.path.exists(obj.image.thumbnail.path) for obj in objs)
+        assert json.loads((tmp_path / 'checkpoint.json').read_text()) == {}
+
+    def test_checkpoint(self, image_upload_file, tmp_path):
+        objs = [ThumbnailModel.objects.create(image=image_upload_file)
+                for _ in range(3)]
+        os.remove(objs[1].image.path)
+        checkpoint = tmp_path / 'checkpoint.json'
+        with pytest.raises(CommandError):
+            call_command(
+                'rendervariations',
+                'tests.ThumbnailModel.image',
+                batch_size=1,
+                checkpoint=str(checkpoint),
+                replace=True,
+            )
+        assert json.loads(checkpoint.read_text()) == {
+            'tests.ThumbnailModel.image': objs[0].pk,
+        }
+
+    def test_checkpoint__completed_field(self, image_upload_file, tmp_path):
+        resized = ResizeModel.objects.create(image=image_upload_file)
+        objs = [ThumbnailModel.objects.create(image=image_upload_file)
+                for _ in range(2)]
+        os.remove(objs[1].image.path)
+        checkpoint = tmp_path / 'checkpoint.json'
+        with pytest.raises(CommandError):
+            call_command(
+                'rendervariations',
+                'tests.ResizeModel.image',
+                'tests.ThumbnailModel.image',
+                batch_size=1,
+                checkpoint=str(checkpoint),
+                replace=True,
+            )
+        assert json.loads(checkpoint.read_text()) == {
+            'tests.ResizeModel.image': True,
+            'tests.ThumbnailModel.image': objs[0].pk,
+        }
+
+        resized.image.delete_variations()
+        ThumbnailModel.objects.filter(pk=objs[1].pk).delete()
+        call_command(
+            'rendervariations',
+            'tests.ResizeModel.image',
+            'tests.ThumbnailModel.image',
+            '--resume',
+            checkpoint=str(checkpoint),
+        )
+        assert not os.path.exists(resized.image.thumbnail.path)
+        assert json.loads(checkpoint.read_text()) == {}
+
+    def test_resume(self, image_upload_file, tmp_path):
+        objs = [ThumbnailModel.objects.create(image=image_upload_file)
+                for _ in range(3)]
+        for obj in objs:
+            obj.image.delete_variations()
+        checkpoint = tmp_path / 'checkpoint.json'
+        checkpoint.write_text(json.dumps({
+            'tests.ThumbnailModel.image': objs[0].pk,
+        }))
+        call_command(
+            'rendervariations',
+            'tests.ThumbnailModel.image',
+            '--resume',
+            checkpoint=str(checkpoint),
+        )
+        assert not os.path.exists(objs[0].image.thumbnail.path)
+        assert os.path.exists(objs[1].image.thumbnail.path)
+        assert os.path.exists(objs[2].image.thumbnail.path)
+        assert json.loads(checkpoint.read_text()) == {}
+
+    def test_no_checkpoint(self, image_upload_file, monkeypatch, tmp_path):
+        monkeypatch.setattr('tempfile.gettempdir', lambda: str(tmp_path))
+        obj = ThumbnailModel.objects.create(image=image_upload_file)
+        obj.image.delete_variations()
+        call_command('rendervariations', 'tests.ThumbnailModel.image', batch_size=1)
+        assert os.path.exists(obj.image.thumbnail.path)
+        assert not os.listdir(str(tmp_path))
+
+    def test_resume__default_checkpoint(self, image_upload_file, monkeypatch,
+                                        tmp_path, settings):
+        monkeypatch.setattr('tempfile.gettempdir', lambda: str(tmp_path))
+        objs = [ThumbnailModel.objects.create(image=image_upload_file)
+                for _ in range(2)]
+        os.remove(objs[1].image.path)
+        with pytest.raises(CommandError):
+            call_command(
+                'rendervariations', 'tests.ThumbnailModel.image', '--resume',
+                batch_size=1, replace=True,
+            )
+        checkpoint, = tmp_path.glob('stdimage-rendervariations*/*.json')
+        assert json.loads(checkpoint.read_text()) == {
+            'tests.ThumbnailModel.image': objs[0].pk,
+        }
+        settings.SETTINGS_MODULE = 'other.settings'
+        call_command(
+            'rendervariations', 'tests.ThumbnailModel.image', '--resume',
+            '--ignore-missing', batch_size=1,
+        )
+        assert json.loads(checkpoint.read_text()) == {
+            'tests.ThumbnailModel.image': objs[0].pk,
+        }
+
+    def test_pk_range(self, image_upload_file, tmp_path):
+        objs = [ThumbnailModel.objects.create(image=image_upload_file)
+                for _ in range(3)]
+        for obj in objs:
+            obj.image.delete_variations()
+        call_command(
+            'rendervariations',
+            'tests.ThumbnailModel.image',
+            pk_range='%d:%d' % (objs[1].pk, objs[2].pk),
+            checkpoint=str(tmp_path / 'checkpoint.json'),
+        )
+        assert not os.path.exists(objs[0].image.thumbnail.path)
+        assert os.path.exists(objs[1].image.thumbnail.path)
+        assert not os.path.exists(objs[2].image.thumbnail.path)
+
+    def test_pk_range__open(self, image_upload_file, tmp_path):
+        objs = [ThumbnailModel.objects.create(image=image_upload_file)
+                for _ in range(2)]
+        for obj in objs:
+            obj.image.delete_variations()
+        call_command(
+            'rendervariations',
+            'tests.ThumbnailModel.image',
+            pk_range='%d:' % objs[1].pk,
+            checkpoint=str(tmp_path / 'checkpoint.json'),
+        )
+        assert not os.path.exists(objs[0].image.thumbnail.path)
+        assert os.path.exists(objs[1].image.thumbnail.path)
+
+    @pytest.mark.parametrize('pk_range', ['1', 'a:b'])
+    def test_pk_range__invalid(self, pk_range):
+        with pytest.raises(CommandError) as exc_info:
+            call_command(
+                'rendervariations',
+                'tests.ThumbnailModel.image',
+                pk_range=pk_range,
+            )
+        assert str(exc_info.value) == (
+            "Error parsing pk-range '%s'. Use format START:END." % pk_range
+        )
+
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_stats(self, image_upload_file, capsys, workers):
+        for _ in range(3):
+            ThumbnailModel.objects.create(image=image_upload_file)
+        call_command(
+            'rendervariations',
+            'tests.ThumbnailModel.image',
+            '--stats',
+            workers=workers,
+            replace=True,
+        )
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0].split()[0] == 'stage'
+        assert [line.split()[:2] for line in lines[1:]] == [
+            ['open', '3'], ['decode', '3'], ['process', '3'],
+            ['encode', '3'], ['save', '3'],
+        ]
+
+    def test_pipeline(self, image_upload_file):
+        objs = [ThumbnailModel.objects.create(image=image_upload_file)
+                for _ in range(5)]
+        for obj in objs:
+            obj.image.delete_variations()
+        call_command(
+            'rendervariations',
+            'tests.ThumbnailModel.image',
+            '--pipeline',
+            workers=2,
+            fetch_workers=2,
+            store_workers=1,
+        )
+        assert all(os.path.exists(obj.image.thumbnail.path) for obj in objs)
+
+    def test_pipeline__no_ignore_missing(self, image_upload_file):
+        obj = ThumbnailModel.objects.create(image=image_upload_file)
+        os.remove(obj.image.path)
+        with pytest.raises(CommandError):
+            call_command(
+                'rendervariations',
+                'tests.ThumbnailModel.image',
+                '--pipeline',
+                replace=True,
+            )
+
+    def test_pipeline__invalid(self):
+        with pytest.raises(CommandError):
+            call_command(
+                'rendervariations',
+                'tests.ThumbnailModel.image',
+                '--pipeline',
+                fetch_workers=0,
+            )
+
     def test_no_replace(self, image_upload_file):
         obj = ThumbnailModel.objects.create(image=image_upload_file)
         file_path = obj.image.thumbnail.path
@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from stdimage import executors
+
+
+class TestInlineExecutor:
+    def test_submit(self):
+        future = executors.InlineExecutor().submit(sum, [1, 2])
+        assert future.done()
+        assert future.result() == 3
+
+    def test_submit__exception(self):
+        future = executors.InlineExecutor().submit(int, 'a')
+        assert future.done()
+        assert isinstance(future.exception(), ValueError)
+
+
+class TestGetExecutor:
+    def test_default(self):
+        assert isinstance(executors.get_executor(), executors.InlineExecutor)
+
+    def test_setting(self, settings):
+        settings.STDIMAGE_RENDER_EXECUTOR = 'thread'
+        executor = executors.get_executor()
+        assert isinstance(executor, ThreadPoolExecutor)
+        assert executors.get_executor('thread') is executor
+
+    def test_instance(self):
+        executor = ThreadPoolExecutor(1)
+        assert executors.get_executor(executor) is executor
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            executors.get_executor('celery')
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+
+from stdimage.files import get_private_dir
+
+
+class TestGetPrivateDir:
+
+    @pytest.fixture(autouse=True)
+    def tempdir(self, monkeypatch, tmpdir):
+        monkeypatch.setattr('tempfile.gettempdir', lambda: str(tmpdir))
+
+    def test_create(self):
+        path = get_private_dir('stdimage-test')
+        assert os.stat(path).st_mode & 0o777 == 0o700
+        assert get_private_dir('stdimage-test') == path
+
+    @pytest.mark.skipif(not hasattr(os, 'getuid'), reason='POSIX only')
+    def test_shared(self):
+        path = get_private_dir('stdimage-test')
+        os.chmod(path, 0o777)
+        with pytest.raises(ImproperlyConfigured):
+            get_private_dir('stdimage-test')
+
+    @pytest.mark.skipif(not hasattr(os, 'getuid'), reason='POSIX only')
+    def test_symlink(self, tmpdir):
+        target = str(tmpdir.mkdir('target'))
+        os.chmod(target, 0o700)
+        os.symlink(target, os.path.join(
+            str(tmpdir), 'stdimage-test-%d' % os.getuid()
+        ))
+        with pytest.raises(ImproperlyConfigured):
+            get_private_dir('stdimage-test')
@@ -0,0 +1,152 @@
+import io
+import os
+
+import pytest
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from stdimage import manifest
+from stdimage.models import StdImageFieldFile
+from tests.models import ManifestModel
+from tests.storage import MemoryStorage
+from tests.test_models import IMG_DIR, TestStdImage
+
+
+class TestManifest:
+    def test_get_manifest_name(self):
+        name = manifest.get_manifest_name('img/image.jpg')
+        assert name == 'img/image.jpg.variations.json'
+        assert name != manifest.get_manifest_name('img/image.png')
+
+    def test_get_spec_hash(self):
+        variation = {'name': 'thumbnail', 'width': 100, 'height': 75,
+                     'crop': False, 'resample': 1, 'kwargs': {}}
+        spec_hash = manifest.get_spec_hash(variation)
+        assert spec_hash == manifest.get_spec_hash(dict(variation, name='other'))
+        assert spec_hash != manifest.get_spec_hash(dict(variation, width=120))
+        assert spec_hash == manifest.get_spec_hash(dict(variation, formats={}))
+        assert spec_hash != manifest.get_spec_hash(
+            dict(variation, formats={'webp': {}})
+        )
+
+    def test_read_manifest__missing(self):
+        assert manifest.read_manifest(MemoryStorage(), 'img/image.jpg') == {}
+
+    def test_read_manifest__invalid(self):
+        storage = MemoryStorage()
+        storage.save('img/image.jpg.variations.json', ContentFile(b'{'))
+        assert manifest.read_manifest(storage, 'img/image.jpg') == {}
+
+    def test_write_manifest(self):
+        storage = MemoryStorage()
+        manifest.write_manifest(storage, 'img/image.jpg', {'a': {'width': 1}})
+        manifest.write_manifest(storage, 'img/image.jpg', {'b': {'width': 2}})
+        assert list(storage.files) == ['img/image.jpg.variations.json']
+        assert manifest.read_manifest(storage, 'img/image.jpg') == {
+            'b': {'width': 2}
+        }
+
+
+class TestRenderWithManifest:
+    @pytest.fixture
+    def storage(self):
+        storage = MemoryStorage()
+        with io.BytesIO() as f:
+            Image.new('RGB', (600, 400), (255, 55, 255)).save(f, 'JPEG')
+            storage.save('img/image.jpg', f)
+        return storage
+
+    def test_render(self, storage):
+        variations = ManifestModel._meta.get_field('image').variations
+        StdImageFieldFile.render_all_variations(
+            'img/image.jpg', variations, storage=storage, manifest=True
+        )
+        entries = manifest.read_manifest(storage, 'img/image.jpg')
+        assert set(entries) == {'thumbnail', 'medium'}
+        thumbnail = entries['thumbnail']
+        assert thumbnail['name'] == 'img/image.thumbnail.jpg'
+        assert (thumbnail['width'], thumbnail['height']) == (100, 67)
+        assert thumbnail['size'] == len(storage.files['img/image.thumbnail.jpg'])
+        assert thumbnail['spec'] == manifest.get_spec_hash(variations['thumbnail'])
+
+    def test_render__no_replace(self, storage):
+        variations = ManifestModel._meta.get_field('image').variations
+        StdImageFieldFile.render_all_variations(
+            'img/image.jpg', variations, storage=storage, manifest=True
+        )
+        storage.calls.clear()
+        assert StdImageFieldFile.render_all_variations(
+            'img/image.jpg', variations, replace=False, storage=storage,
+            manifest=True,
+        ) == []
+        assert storage.calls == {'open': 1}
+
+    def test_render__partial(self, storage):
+        variations = ManifestModel._meta.get_field('image').variations
+        StdImageFieldFile.render_variation(
+            'img/image.jpg', variations['thumbnail'], storage=storage, manifest=True
+        )
+        assert StdImageFieldFile.render_all_variations(
+            'img/image.jpg', variations, replace=False, storage=storage,
+            manifest=True,
+        ) == ['img/image.medium.jpg']
+        assert set(manifest.read_manifest(storage, 'img/image.jpg')) == {
+            'thumbnail', 'medium'
+        }
+
+    def test_render__same_stem(self, storage):
+        variations = ManifestModel._meta.get_field('image').variations
+        with io.BytesIO() as f:
+            Image.new('RGB', (600, 400), (255, 55, 255)).save(f, 'PNG')
+            storage.save('img/image.png', f)
+        StdImageFieldFile.render_all_variations(
+            'img/image.png', variations, storage=storage, manifest=True
+        )
+        for name in ('img/image.thumbnail.png', 'img/image.medium.png',
+                     manifest.get_manifest_name('img/image.png')):
+            storage.delete(name)
+        StdImageFieldFile.render_all_variations(
+            'img/image.jpg', variations, storage=storage, manifest=True
+        )
+        assert StdImageFieldFile.render_all_variations(
+            'img/image.png', variations, replace=False, storage=storage,
+            manifest=True,
+        ) == ['img/image.thumbnail.png', 'img/image.medium.png']
+        assert manifest.read_manifest(storage, 'img/image.jpg')['medium'][
+            'name'] == 'img/image.medium.jpg'
+
+    def test_render__outdated(self, storage):
+        variations = ManifestModel._meta.get_field('image').variations
+        StdImageFieldFile.render_all_variations(
+            'img/image.jpg', variations, storage=storage, manifest=True
+        )
+        medium = storage.files['img/image.medium.jpg']
+        variations = dict(
+            variations, thumbnail=dict(variations['thumbnail'], width=120, height=120)
+        )
+        assert StdImageFieldFile.render_all_variations(
+            'img/image.jpg', variations, replace=False, storage=storage,
+            manifest=True,
+        ) == ['img/image.thumbnail.jpg']
+        assert storage.files['img/image.medium.jpg'] is medium
+        entries = manifest.read_manifest(storage, 'img/image.jpg')
+        assert entries['thumbnail']['width'] == 120
+        assert entries['thumbnail']['spec'] == manifest.get_spec_hash(
+            variations['thumbnail']
+        )
+        with storage.open('img/image.thumbnail.jpg') as f:
+            assert Image.open(f).size == (120, 80)
+
+
+class TestManifestModel(TestStdImage):
+
+    def test_save(self, db):
+        instance = ManifestModel.objects.create(image=self.fixtures['600x400.jpg'])
+        assert os.path.exists(os.path.join(IMG_DIR, '600x400.jpg.variations.json'))
+        entries = instance.image.get_manifest()
+        assert entries['medium']['width'] == 400
+
+    def test_delete(self, db):
+        instance = ManifestModel.objects.create(image=self.fixtures['600x400.jpg'])
+        instance.delete()
+        assert not os.path.exists(os.path.join(IMG_DIR, '600x400.jpg.variations.json'))
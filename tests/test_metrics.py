@@ -0,0 +1,109 @@
+import io
+import pickle
+
+import pytest
+from PIL import Image
+
+from stdimage.metrics import RenderStats, percentile
+from stdimage.models import StdImageFieldFile
+from stdimage.signals import render_stage
+from tests.models import ThumbnailModel
+from tests.storage import MemoryStorage
+
+
+@pytest.fixture
+def storage():
+    storage = MemoryStorage()
+    with io.BytesIO() as f:
+        Image.new('RGB', (600, 400), (255, 55, 255)).save(f, 'JPEG')
+        storage.save('img/image.jpg', f)
+    return storage
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([3], 90) == 3
+
+
+class TestRenderStage:
+    def test_send(self, storage):
+        events = []
+
+        def receiver(**kwargs):
+            events.append(kwargs)
+
+        render_stage.connect(receiver)
+        try:
+            variations = ThumbnailModel._meta.get_field('image').variations
+            StdImageFieldFile.render_all_variations(
+                'img/image.jpg', variations, storage=storage
+            )
+        finally:
+            render_stage.disconnect(receiver)
+
+        assert [e['stage'] for e in events] == [
+            'open', 'decode', 'process', 'encode', 'save'
+        ]
+        assert all(e['sender'] is StdImageFieldFile for e in events)
+        assert all(e['file_name'] == 'img/image.jpg' for e in events)
+        assert all(e['duration'] >= 0 for e in events)
+        assert all(e['max_rss'] > 0 for e in events)
+        open_, decode, process, encode, save = events
+        assert open_['variation'] is None
+        assert open_['format'] is None
+        assert decode['format'] == 'JPEG'
+        assert decode['size'] == (300, 200)  # draft mode
+        assert decode['bytes'] > 0
+        assert process['variation'] == 'thumbnail'
+        assert process['size'] == (300, 200)
+        assert process['bytes'] is None
+        assert encode['bytes'] == save['bytes'] == len(
+            storage.files['img/image.thumbnail.jpg']
+        )
+
+
+class TestRenderStats:
+    def test_collect(self, storage):
+        variations = ThumbnailModel._meta.get_field('image').variations
+        with RenderStats() as stats:
+            StdImageFieldFile.render_all_variations(
+                'img/image.jpg', variations, storage=storage
+            )
+        StdImageFieldFile.render_all_variations(
+            'img/image.jpg', variations, storage=storage
+        )
+        summary = stats.summary()
+        assert list(summary) == ['open', 'decode', 'process', 'encode', 'save']
+        assert all(row['count'] == 1 for row in summary.values())
+        assert summary['save']['bytes'] > 0
+        assert summary['save']['p50'] == summary['save']['total']
+
+    def test_file_name(self):
+        stats = RenderStats(file_name='a.jpg')
+        stats.receive(None, 'open', 1, file_name='a.jpg')
+        stats.receive(None, 'open', 1, file_name='b.jpg')
+        assert stats.summary()['open']['count'] == 1
+
+    def test_merge(self):
+        stats = RenderStats()
+        other = RenderStats()
+        other.receive(None, 'save', 0.5, 10)
+        stats.merge(pickle.loads(pickle.dumps(other)))
+        stats.receive(None, 'save', 1.5, 20, max_rss=2048)
+        assert stats.summary()['save'] == {
+            'count': 2, 'total': 2.0, 'p50': 0.5, 'p90': 1.5, 'p99': 1.5,
+            'bytes': 30, 'max_rss': 2048,
+        }
+
+    def test_format_summary(self):
+        stats = RenderStats()
+        stats.receive(None, 'decode', 0.002, 100, max_rss=3 * 1024 * 1024)
+        lines = stats.format_summary().splitlines()
+        assert lines[0].split() == [
+            'stage', 'count', 'total', 'p50', 'p90', 'p99', 'bytes', 'max_rss'
+        ]
+        assert lines[1].split() == [
+            'decode', '1', '2.0ms', '2.0ms', '2.0ms', '2.0ms', '100', '3.0MB'
+        ]
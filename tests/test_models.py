@@ -1,17 +1,30 @@
+import asyncio
 import io
 import os
+import pickle
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from PIL import Image
+from django.template import Context, Template
+from PIL import Image, ImageChops, ImageStat
+
+from stdimage import models as models_module
+from stdimage.metrics import RenderStats
+from stdimage.models import (JPEGFieldFile, SourceTooLargeError, StdImageField,
+                             StdImageFieldFile, VariationFieldFile,
+                             VariationRenderError, get_pixel_budget,)
 
 from . import models
 from .models import (AdminDeleteModel, AdminUpdateModel, CustomRenderVariationsModel,
+                     DimensionsModel, FormatsModel, ManifestModel, OnDemandModel,
                      ResizeCropModel, ResizeModel, SimpleModel, ThumbnailModel,
                      ThumbnailWithoutDirectoryModel, UtilVariationsModel,)
+from .storage import MemoryStorage
 
 IMG_DIR = os.path.join(settings.MEDIA_ROOT, 'img')
 
@@ -167,6 +180,711 @@ class TestModel(TestStdImage):
             deferred.image
         assert instance.image.thumbnail == deferred.image.thumbnail
 
+    def test_variations__lazy(self, db):
+        instance = ResizeModel.objects.create(image=self.fixtures['600x400.jpg'])
+        instance = ResizeModel.objects.get(pk=instance.pk)
+        assert 'thumbnail' not in vars(instance.image)
+        assert instance.image.thumbnail.name == 'img/600x400.thumbnail.jpg'
+        assert instance.image.thumbnail is instance.image.thumbnail
+        assert 'medium' not in vars(instance.image)
+
+    def test_variations__name_changed(self, db):
+        instance = ResizeModel.objects.create(image=self.fixtures['600x400.jpg'])
+        assert instance.image.thumbnail.name == 'img/600x400.thumbnail.jpg'
+        instance.image.name = 'img/other.jpg'
+        assert instance.image.thumbnail.name == 'img/other.thumbnail.jpg'
+
+    def test_variations__pickle(self, db):
+        instance = ResizeModel.objects.create(image=self.fixtures['600x400.jpg'])
+        instance.image.thumbnail
+        instance = pickle.loads(pickle.dumps(instance))
+        assert instance.image.thumbnail.name == 'img/600x400.thumbnail.jpg'
+
+    def test_variations__set_variations(self, db):
+        instance = ResizeModel.objects.create(image=self.fixtures['600x400.jpg'])
+        instance._meta.get_field('image').set_variations(instance)
+        assert isinstance(vars(instance.image)['thumbnail'], VariationFieldFile)
+        assert instance.image.thumbnail.width == 100
+
+    def test_variations__uncommitted(self, db):
+        instance = ResizeModel(image=self.fixtures['600x400.jpg'])
+        with pytest.raises(AttributeError):
+            instance.image.thumbnail
+
+    def test_variations__unknown(self, db):
+        instance = ResizeModel.objects.create(image=self.fixtures['600x400.jpg'])
+        with pytest.raises(AttributeError):
+            instance.image.large
+
+
+class TestRenderOnDemand(TestStdImage):
+
+    def test_save(self, db):
+        OnDemandModel.objects.create(image=self.fixtures['600x400.jpg'])
+        assert os.path.exists(os.path.join(IMG_DIR, '600x400.jpg'))
+        assert not os.path.exists(os.path.join(IMG_DIR, '600x400.thumbnail.jpg'))
+        assert not os.path.exists(os.path.join(IMG_DIR, '600x400.medium.jpg'))
+
+    @pytest.mark.parametrize('attr', ['url', 'path', 'size', 'width'])
+    def test_access(self, db, attr):
+        instance = OnDemandModel.objects.create(image=self.fixtures['600x400.jpg'])
+        instance = OnDemandModel.objects.get(pk=instance.pk)
+        getattr(instance.image.thumbnail, attr)
+        assert os.path.exists(os.path.join(IMG_DIR, '600x400.thumbnail.jpg'))
+        assert not os.path.exists(os.path.join(IMG_DIR, '600x400.medium.jpg'))
+
+    def test_read(self, db):
+        instance = OnDemandModel.objects.create(image=self.fixtures['600x400.jpg'])
+        with instance.image.medium.open() as f:
+            with Image.open(f) as img:
+                assert img.size == (400, 267)
+
+    def test_concurrent_access(self, db, monkeypatch):
+        instance = OnDemandModel.objects.create(image=self.fixtures['600x400.jpg'])
+        calls = []
+        open_image = StdImageFieldFile.open_image.__func__
+
+        def _open_image(cls, *args, **kwargs):
+            calls.append(args)
+            time.sleep(0.1)
+            return open_image(cls, *args, **kwargs)
+
+        monkeypatch.setattr(StdImageFieldFile, 'open_image', classmethod(_open_image))
+        variation = instance.image.field.variations['medium']
+        variation_files = [
+            VariationFieldFile(instance.image, variation) for _ in range(5)
+        ]
+        with ThreadPoolExecutor(5) as executor:
+            paths = set(executor.map(lambda f: f.path, variation_files))
+        assert len(calls) == 1
+        assert paths == {os.path.join(IMG_DIR, '600x400.medium.jpg')}
+
+    def test_queue_executor(self, db, settings, tmpdir):
+        instance = OnDemandModel.objects.create(image=self.fixtures['600x400.jpg'])
+        settings.STDIMAGE_RENDER_EXECUTOR = 'queue'
+        settings.STDIMAGE_QUEUE_DIR = str(tmpdir)
+        instance = OnDemandModel.objects.get(pk=instance.pk)
+        assert instance.image.thumbnail.url.endswith('/img/600x400.thumbnail.jpg')
+        assert os.path.exists(os.path.join(IMG_DIR, '600x400.thumbnail.jpg'))
+        StdImageFieldFile.get_srcsets([instance.image])
+        assert os.path.exists(os.path.join(IMG_DIR, '600x400.medium.jpg'))
+
+    def test_missing_source(self, db):
+        instance = OnDemandModel.objects.create(image=self.fixtures['600x400.jpg'])
+        os.remove(instance.image.path)
+        with pytest.raises(FileNotFoundError):
+            instance.image.thumbnail.url
+        assert not models_module._render_locks
+
+    def test_pickle(self, db):
+        instance = OnDemandModel.objects.create(image=self.fixtures['600x400.jpg'])
+        variation_file = pickle.loads(pickle.dumps(instance.image.thumbnail))
+        assert variation_file.width == 100
+
+
+class TestFormats(TestStdImage):
+
+    def test_add_variation(self):
+        variations = FormatsModel._meta.get_field('image').variations
+        assert variations['thumbnail']['formats'] == {'webp': {}, 'png': {}}
+        assert variations['medium']['formats'] == {'webp': {'quality': 50}}
+        assert SimpleModel._meta.get_field('image').formats is None
+        assert ThumbnailModel._meta.get_field('image').variations['thumbnail'][
+            'formats'] == {}
+
+    def test_save(self, db):
+        instance = FormatsModel.objects.create(image=self.fixtures['600x400.jpg'])
+        assert set(os.listdir(IMG_DIR)) == {
+            '600x400.jpg',
+            '600x400.thumbnail.jpg',
+            '600x400.thumbnail.webp',
+            '600x400.thumbnail.png',
+            '600x400.medium.jpg',
+            '600x400.medium.webp',
+        }
+        sibling = instance.image.thumbnail.webp
+        assert sibling.name == 'img/600x400.thumbnail.webp'
+        assert sibling.url.endswith('/img/600x400.thumbnail.webp')
+        with sibling.open() as f, Image.open(f) as img:
+            assert img.format == 'WEBP'
+            assert img.size == (100, 67)
+        assert instance.image.medium.webp.width == 400
+
+    def test_add_variation__unknown_format(self):
+        with pytest.raises(ValueError):
+            StdImageField(variations={'thumbnail': (100, 75)}, formats=['xyz'])
+
+    def test_save__source_format(self, db):
+        with io.BytesIO() as f:
+            Image.new('RGB', (600, 400), (255, 55, 255)).save(f, 'PNG')
+            upload = SimpleUploadedFile('600x400.png', f.getvalue())
+        instance = FormatsModel.objects.create(image=upload)
+        assert set(os.listdir(IMG_DIR)) == {
+            '600x400.png',
+            '600x400.thumbnail.png',
+            '600x400.thumbnail.webp',
+            '600x400.medium.png',
+            '600x400.medium.webp',
+        }
+        instance.image.delete()
+        assert os.listdir(IMG_DIR) == []
+
+    def test_attributes(self, db):
+        instance = FormatsModel.objects.create(image=self.fixtures['600x400.jpg'])
+        assert instance.image.thumbnail.webp is instance.image.thumbnail.webp
+        with pytest.raises(AttributeError):
+            instance.image.medium.png
+        with pytest.raises(AttributeError):
+            instance.image.thumbnail.webp.png
+
+    def test_single_decode(self, db):
+        with RenderStats() as stats:
+            FormatsModel.objects.create(image=self.fixtures['600x400.jpg'])
+        summary = stats.summary()
+        assert summary['decode']['count'] == 1
+        assert summary['process']['count'] == 2
+        assert summary['save']['count'] == 5
+
+    def test_delete(self, db):
+        instance = FormatsModel.objects.create(image=self.fixtures['600x400.jpg'])
+        instance.image.delete()
+        assert os.listdir(IMG_DIR) == []
+
+    def test_missing_sibling(self):
+        storage = MemoryStorage()
+        with io.BytesIO() as f:
+            Image.new('RGB', (600, 400), (255, 55, 255)).save(f, 'JPEG')
+            storage.save('img/image.jpg', f)
+        variations = FormatsModel._meta.get_field('image').variations
+        StdImageFieldFile.render_all_variations(
+            'img/image.jpg', variations, storage=storage
+        )
+        storage.delete('img/image.thumbnail.png')
+        assert StdImageFieldFile.render_all_variations(
+            'img/image.jpg', variations, replace=False, storage=storage
+        ) == ['img/image.thumbnail.jpg']
+        assert 'img/image.thumbnail.png' in storage.files
+
+    def test_pickle(self, db):
+        instance = FormatsModel.objects.create(image=self.fixtures['600x400.jpg'])
+        sibling = pickle.loads(pickle.dumps(instance.image.thumbnail.webp))
+        assert sibling.extension == 'webp'
+        assert sibling.name == 'img/600x400.thumbnail.webp'
+        assert sibling.width == 100
+
+
+class TestVariationDimensions(TestStdImage):
+
+    @pytest.fixture
+    def no_open(self, monkeypatch):
+        def _open(self, mode='rb'):
+            raise AssertionError('%s was opened' % self.name)
+        monkeypatch.setattr(VariationFieldFile, 'open', _open)
+
+    def test_dimension_fields(self, db, no_open):
+        instance = DimensionsModel.objects.create(
+            image=self.fixtures['600x400.jpg']
+        )
+        instance = DimensionsModel.objects.get(pk=instance.pk)
+        assert (instance.image.thumbnail.width,
+                instance.image.thumbnail.height) == (100, 67)
+        assert (instance.image.square.width,
+                instance.image.square.height) == (50, 50)
+
+    def test_source_dimensions(self, db, no_open):
+        instance = ResizeModel.objects.create(image=self.fixtures['600x400.jpg'])
+        instance = ResizeModel.objects.get(pk=instance.pk)
+        assert instance.image.width == 600
+        assert instance.image.medium.height == 267
+
+    def test_manifest(self, db, no_open):
+        instance = ManifestModel.objects.create(image=self.fixtures['600x400.jpg'])
+        instance = ManifestModel.objects.get(pk=instance.pk)
+        assert instance.image.medium.width == 400
+        assert instance.image.medium.height == 267
+
+    def test_fallback(self, db):
+        instance = ResizeModel.objects.create(image=self.fixtures['600x400.jpg'])
+        instance = ResizeModel.objects.get(pk=instance.pk)
+        assert instance.image.thumbnail.width == 100
+
+    @pytest.mark.parametrize('source_size, size', [
+        ((1949, 1596), (904, 528)),
+        ((2499, 549), (107, 580)),
+        ((918, 540), (1324, 206)),
+        ((2400, 2221), (102, 279)),
+        ((300, 200), (400, 400)),
+    ])
+    def test_render_matches(self, source_size, size):
+        storage = MemoryStorage()
+        with io.BytesIO() as f:
+            Image.new('RGB', source_size).save(f, 'JPEG')
+            storage.save('image.jpg', f)
+        field = StdImageField(variations={
+            'large': (size[0] * 2, size[1] * 2),
+            'small': size,
+        })
+        StdImageFieldFile.render_all_variations(
+            'image.jpg', field.variations, storage=storage
+        )
+        for variation in field.variations.values():
+            name = StdImageFieldFile.get_variation_name('image.jpg', variation['name'])
+            with storage.open(name) as f, Image.open(f) as img:
+                assert img.size == StdImageFieldFile.get_variation_size(
+                    source_size, variation
+                )
+
+
+class TestSrcset(TestStdImage):
+
+    def test_srcset(self, db):
+        instance = ResizeModel.objects.create(image=self.fixtures['600x400.jpg'])
+        assert instance.image.srcset() == (
+            '/img/600x400.thumbnail.jpg 100w, /img/600x400.medium.jpg 400w'
+        )
+        assert instance.image.srcset(['medium']) == '/img/600x400.medium.jpg 400w'
+
+    def test_empty(self, db):
+        assert SimpleModel().image.srcset() == ''
+
+    def test_grid(self, db, monkeypatch):
+        instances = [
+            ResizeModel.objects.create(image=self.fixtures['600x400.jpg'])
+            for _ in range(3)
+        ]
+        calls = []
+        get_urls = models_module.get_urls
+
+        def _get_urls(storage, names):
+            calls.append(names)
+            return get_urls(storage, names)
+
+        monkeypatch.setattr(models_module, 'get_urls', _get_urls)
+        srcsets = StdImageFieldFile.get_srcsets(i.image for i in instances)
+        assert len(calls) == 1
+        assert len(calls[0]) == 6
+        assert srcsets[2] == instances[2].image.srcset()
+
+    def test_render_on_demand(self, db, monkeypatch):
+        instance = OnDemandModel.objects.create(image=self.fixtures['600x400.jpg'])
+        calls = []
+        open_image = StdImageFieldFile.open_image.__func__
+
+        def _open_image(cls, *args, **kwargs):
+            calls.append(args)
+            return open_image(cls, *args, **kwargs)
+
+        monkeypatch.setattr(StdImageFieldFile, 'open_image', classmethod(_open_image))
+        assert instance.image.srcset().endswith('/img/600x400.medium.jpg 400w')
+        assert len(calls) == 1
+        assert os.path.exists(os.path.join(IMG_DIR, '600x400.thumbnail.jpg'))
+
+    def test_template_tag(self, db):
+        instance = ResizeModel.objects.create(image=self.fixtures['600x400.jpg'])
+        template = Template(
+            '{% load stdimage %}{% srcset object.image "thumbnail" %}'
+            '|{% srcset empty.image %}'
+        )
+        assert template.render(Context({
+            'object': instance, 'empty': SimpleModel(),
+        })) == '/img/600x400.thumbnail.jpg 100w|'
+
+
+class TestRenderAllVariations(TestStdImage):
+
+    def test_single_decode(self, db, monkeypatch):
+        instance = ResizeModel.objects.create(
+            image=self.fixtures['600x400.jpg']
+        )
+        calls = []
+        storage_class = type(instance.image.storage._wrapped)
+        storage_open = storage_class.open
+
+        def _open(self, name, *args, **kwargs):
+            calls.append(name)
+            return storage_open(self, name, *args, **kwargs)
+
+        monkeypatch.setattr(storage_class, 'open', _open)
+        instance.image.render_variations()
+        assert calls == [instance.image.name]
+
+    def test_cascade(self, db, monkeypatch):
+        instance = ResizeModel.objects.create(
+            image=self.fixtures['600x400.jpg']
+        )
+        sizes = {}
+        process_variation = StdImageFieldFile.process_variation.__func__
+
+        def _process_variation(cls, variation, image):
+            sizes[variation['name']] = image.size
+            return process_variation(cls, variation, image)
+
+        monkeypatch.setattr(
+            StdImageFieldFile, 'process_variation',
+            classmethod(_process_variation),
+        )
+        instance.image.render_variations()
+        assert sizes['medium'] == (600, 400)
+        assert sizes['thumbnail'] == (400, 267)
+        assert instance.image.thumbnail.width == 100
+        assert instance.image.thumbnail.height == 67
+
+    def test_plan_variations(self):
+        variations = [
+            {'name': 'small', 'width': 200, 'height': 100, 'crop': False},
+            {'name': 'large', 'width': 300, 'height': 300, 'crop': True},
+            {'name': 'medium', 'width': 300, 'height': 300, 'crop': False},
+        ]
+        pending = [(v, v['name']) for v in variations]
+        plan = StdImageFieldFile.plan_variations((600, 400), pending)
+        assert [(v['name'], base) for v, _, base in plan] == [
+            ('large', None),
+            ('medium', None),
+            ('small', 1),
+        ]
+
+    def test_plan_variations__crop(self):
+        variations = [
+            {'name': 'square_64', 'width': 64, 'height': 64, 'crop': True},
+            {'name': 'square_512', 'width': 512, 'height': 512, 'crop': True},
+            {'name': 'square_128', 'width': 128, 'height': 128, 'crop': True},
+            {'name': 'wide', 'width': 200, 'height': 100, 'crop': True},
+            {'name': 'square_256', 'width': 256, 'height': 256, 'crop': True},
+            {'name': 'resized', 'width': 100, 'height': 100, 'crop': False},
+        ]
+        pending = [(v, v['name']) for v in variations]
+        plan = StdImageFieldFile.plan_variations((2000, 1600), pending)
+        assert [(v['name'], base) for v, _, base in plan] == [
+            ('square_512', None),
+            ('square_256', 0),
+            ('wide', None),
+            ('square_128', 1),
+            ('resized', None),
+            ('square_64', 4),
+        ]
+
+    @pytest.mark.parametrize('base, variation, expected', [
+        ((300, 300, False), (100, 50, True), True),
+        ((300, 300, True), (100, 100, True), True),
+        ((600, 400, True), (301, 200, True), True),
+        ((300, 200, True), (150, 110, True), False),
+        ((300, 300, True), (100, 100, False), False),
+        ((300, None, True), (100, 100, True), False),
+    ])
+    def test_is_base(self, base, variation, expected):
+        base = dict(zip(('width', 'height', 'crop'), base))
+        variation = dict(zip(('width', 'height', 'crop'), variation))
+        assert StdImageFieldFile.is_base(base, variation) is expected
+
+    @pytest.mark.parametrize('field_class', [StdImageFieldFile, JPEGFieldFile])
+    def test_crop_cascade(self, field_class):
+        """Crops derived from larger crops look like crops of the source."""
+        size = 1600, 1200
+        source = Image.merge('RGB', [
+            Image.linear_gradient('L').resize(size),
+            Image.radial_gradient('L').resize(size),
+            Image.effect_mandelbrot(size, (-2, -1.5, 1, 1.5), 100),
+        ])
+        source.format = 'JPEG'
+        field = StdImageField(variations={
+            'square_%d' % i: (i, i, True) for i in (64, 128, 256, 512)
+        })
+        pending = [(v, v['name']) for v in field.variations.values()]
+        plan = field_class.plan_variations(source.size, pending)
+        assert [base for _, _, base in plan] == [None, 0, 1, 2]
+
+        cascade = [source]
+        for variation, _, base in plan:
+            base_image = source if base is None else cascade[base + 1]
+            image, _ = field_class.process_variation(variation, base_image.copy())
+            cascade.append(image)
+        for (variation, _, _), image in zip(plan, cascade[1:]):
+            expected, _ = field_class.process_variation(variation, source.copy())
+            assert image.size == expected.size
+            diff = ImageStat.Stat(ImageChops.difference(
+                image.convert('RGB'), expected.convert('RGB')
+            ))
+            assert max(diff.mean) < 2
+
+    @pytest.mark.parametrize('executor', ['inline', 'thread', 'process'])
+    def test_executor(self, db, executor):
+        instance = ResizeModel.objects.create(
+            image=self.fixtures['600x400.jpg']
+        )
+        instance.image.delete_variations()
+        StdImageFieldFile.render_all_variations(
+            instance.image.name, instance.image.field.variations,
+            storage=instance.image.storage, executor=executor,
+        )
+        assert instance.image.medium.width == 400
+        assert instance.image.thumbnail.width == 100
+
+    def test_executor__errors(self, db, monkeypatch):
+        instance = ResizeModel.objects.create(
+            image=self.fixtures['600x400.jpg']
+        )
+        instance.image.delete_variations()
+        process_variation = StdImageFieldFile.process_variation.__func__
+
+        def _process_variation(cls, variation, image):
+            if variation['name'] == 'medium':
+                raise ValueError('boom')
+            return process_variation(cls, variation, image)
+
+        monkeypatch.setattr(
+            StdImageFieldFile, 'process_variation',
+            classmethod(_process_variation),
+        )
+        with pytest.raises(VariationRenderError) as exc_info:
+            instance.image.render_variations()
+        assert list(exc_info.value.errors) == ['medium']
+        assert 'medium' in str(exc_info.value)
+        assert isinstance(exc_info.value.__cause__, ValueError)
+        assert os.path.exists(os.path.join(IMG_DIR, '600x400.thumbnail.jpg'))
+
+    def test_draft_image(self):
+        with io.BytesIO() as f:
+            Image.new('RGB', (2000, 1600), (255, 55, 255)).save(f, 'JPEG')
+            with Image.open(f) as img:
+                StdImageFieldFile.draft_image(
+                    img, [{'width': 100, 'height': 75, 'crop': False}]
+                )
+                assert img.size == (250, 200)
+                img.load()
+                assert img.size == (250, 200)
+
+    def test_draft_image__large_variation(self):
+        with io.BytesIO() as f:
+            Image.new('RGB', (2000, 1600), (255, 55, 255)).save(f, 'JPEG')
+            with Image.open(f) as img:
+                StdImageFieldFile.draft_image(img, [
+                    {'width': 100, 'height': 75, 'crop': False},
+                    {'width': None, 'height': None, 'crop': False},
+                ])
+                assert img.size == (2000, 1600)
+
+    def test_draft_image__unsupported_format(self):
+        with io.BytesIO() as f:
+            Image.new('RGB', (2000, 1600), (255, 55, 255)).save(f, 'PNG')
+            with Image.open(f) as img:
+                StdImageFieldFile.draft_image(
+                    img, [{'width': 100, 'height': 75, 'crop': False}]
+                )
+                assert img.size == (2000, 1600)
+
+    def test_draft_image__pixel_budget(self):
+        with io.BytesIO() as f:
+            Image.new('RGB', (2000, 1600), (255, 55, 255)).save(f, 'JPEG')
+            with Image.open(f) as img:
+                StdImageFieldFile.draft_image(
+                    img, [{'width': None, 'height': None, 'crop': False}],
+                    max_pixels=250000,
+                )
+                assert img.size == (500, 400)
+
+    def test_get_pixel_budget(self, settings):
+        assert get_pixel_budget('RGB') is None
+        assert get_pixel_budget('RGB', 1000) == 1000
+        settings.STDIMAGE_MAX_MEMORY = 4000
+        assert get_pixel_budget('RGB') == 1000
+        assert get_pixel_budget('L') == 4000
+        assert get_pixel_budget('I;16') == 2000
+        assert get_pixel_budget('RGB', 500) == 500
+        settings.STDIMAGE_MAX_PIXELS = 200
+        assert get_pixel_budget('RGB') == 200
+
+    def test_render__source_too_large(self, monkeypatch):
+        storage = MemoryStorage()
+        with io.BytesIO() as f:
+            Image.new('RGB', (2000, 1600), (255, 55, 255)).save(f, 'PNG')
+            storage.save('img/image.png', f)
+        monkeypatch.setattr(
+            Image.Image, 'load', lambda self: pytest.fail('image was decoded')
+        )
+        variations = ResizeModel._meta.get_field('image').variations
+        with pytest.raises(SourceTooLargeError) as exc_info:
+            StdImageFieldFile.render_all_variations(
+                'img/image.png', variations, storage=storage, max_pixels=1000000,
+            )
+        assert exc_info.value.size == (2000, 1600)
+        assert str(exc_info.value) == (
+            'Image "img/image.png" with 2000x1600 px exceeds the budget of 1000000 px.'
+        )
+        assert set(storage.files) == {'img/image.png'}
+
+    def test_render__pixel_budget(self):
+        storage = MemoryStorage()
+        with io.BytesIO() as f:
+            Image.new('RGB', (600, 400), (255, 55, 255)).save(f, 'JPEG')
+            storage.save('img/image.jpg', f)
+        variations = ResizeModel._meta.get_field('image').variations
+        StdImageFieldFile.render_all_variations(
+            'img/image.jpg', variations, storage=storage, max_pixels=20000,
+        )
+        with Image.open(storage.open('img/image.medium.jpg')) as img:
+            assert img.size == (150, 100)
+        with Image.open(storage.open('img/image.thumbnail.jpg')) as img:
+            assert img.size == (100, 67)
+
+    def test_render__field_pixel_budget(self, db, monkeypatch):
+        field = ResizeModel._meta.get_field('image')
+        monkeypatch.setattr(field, 'max_pixels', 1000)
+        with pytest.raises(SourceTooLargeError):
+            ResizeModel.objects.create(image=self.fixtures['600x400.gif'])
+
+    def test_validate__pixel_budget(self, db, monkeypatch):
+        field = ResizeModel._meta.get_field('image')
+        monkeypatch.setattr(field, 'max_pixels', 1000)
+        instance = ResizeModel(image=self.fixtures['600x400.gif'])
+        with pytest.raises(ValidationError) as exc_info:
+            instance.full_clean()
+        assert exc_info.value.error_dict['image'][0].code == 'max_pixels'
+        assert not os.path.exists(IMG_DIR)
+
+    def test_validate__no_pixel_budget(self, db, monkeypatch):
+        monkeypatch.setattr(
+            Image, 'open', lambda *args, **kwargs: pytest.fail('header was parsed')
+        )
+        instance = ResizeModel(image=SimpleUploadedFile('image.jpg', b'not an image'))
+        instance.full_clean()
+
+    def test_validate__pixel_budget_not_an_image(self, db, monkeypatch):
+        field = ResizeModel._meta.get_field('image')
+        monkeypatch.setattr(field, 'max_pixels', 1000)
+        instance = ResizeModel(image=SimpleUploadedFile('image.jpg', b'not an image'))
+        instance.full_clean()
+
+    def test_validate__pixel_budget_draft(self, db, monkeypatch):
+        field = ResizeModel._meta.get_field('image')
+        monkeypatch.setattr(field, 'max_pixels', 20000)
+        with io.BytesIO() as f:
+            Image.new('RGB', (600, 400), (255, 55, 255)).save(f, 'JPEG')
+            upload = SimpleUploadedFile('600x400.jpg', f.getvalue())
+        ResizeModel(image=upload).full_clean()
+
+    def test_validate__pixel_budget_form(self, admin_client, settings):
+        settings.STDIMAGE_MAX_PIXELS = 1000
+        response = admin_client.post('/admin/tests/resizemodel/add/', {
+            'image': self.fixtures['600x400.gif'],
+        })
+        assert 'too large' in response.context['adminform'].form.errors['image'][0]
+        assert not os.path.exists(os.path.join(IMG_DIR, '600x400.gif'))
+
+    @pytest.mark.parametrize('executor', ['inline', 'thread'])
+    def test_arender_variations(self, db, executor):
+        instance = ResizeModel.objects.create(
+            image=self.fixtures['600x400.jpg']
+        )
+        instance.image.delete_variations()
+        asyncio.run(StdImageFieldFile.arender_all_variations(
+            instance.image.name, instance.image.field.variations,
+            storage=instance.image.storage, executor=executor,
+        ))
+        assert instance.image.medium.width == 400
+        assert instance.image.thumbnail.width == 100
+
+    def test_arender_variations__field_file(self, db):
+        instance = ResizeModel.objects.create(
+            image=self.fixtures['600x400.jpg']
+        )
+        instance.image.delete_variations()
+        asyncio.run(instance.image.arender_variations())
+        assert os.path.exists(os.path.join(IMG_DIR, '600x400.medium.jpg'))
+        assert os.path.exists(os.path.join(IMG_DIR, '600x400.thumbnail.jpg'))
+
+    def test_arender_variation(self, db):
+        instance = ResizeModel.objects.create(
+            image=self.fixtures['600x400.jpg']
+        )
+        instance.image.delete_variations()
+        variation_name = asyncio.run(StdImageFieldFile.arender_variation(
+            instance.image.name,
+            instance.image.field.variations['thumbnail'],
+            storage=instance.image.storage,
+        ))
+        assert variation_name == 'img/600x400.thumbnail.jpg'
+        assert os.path.exists(os.path.join(IMG_DIR, '600x400.thumbnail.jpg'))
+        assert not os.path.exists(os.path.join(IMG_DIR, '600x400.medium.jpg'))
+
+    def test_arender_variations__errors(self, db, monkeypatch, caplog):
+        instance = ResizeModel.objects.create(
+            image=self.fixtures['600x400.jpg']
+        )
+        instance.image.delete_variations()
+        process_variation = StdImageFieldFile.process_variation.__func__
+
+        def _process_variation(cls, variation, image):
+            if variation['name'] == 'medium':
+                raise ValueError('boom')
+            return process_variation(cls, variation, image)
+
+        monkeypatch.setattr(
+            StdImageFieldFile, 'process_variation',
+            classmethod(_process_variation),
+        )
+        with pytest.raises(VariationRenderError) as exc_info:
+            asyncio.run(instance.image.arender_variations())
+        assert list(exc_info.value.errors) == ['medium']
+        assert isinstance(exc_info.value.__cause__, ValueError)
+        assert os.path.exists(os.path.join(IMG_DIR, '600x400.thumbnail.jpg'))
+        assert 'Failed to render variation "medium".' in caplog.messages
+
+    def test_remote_storage(self):
+        storage = MemoryStorage()
+        with io.BytesIO() as f:
+            Image.new('RGB', (600, 400), (255, 55, 255)).save(f, 'JPEG')
+            storage.save('img/image.jpg', f)
+        variations = ResizeModel._meta.get_field('image').variations
+        StdImageFieldFile.render_all_variations(
+            'img/image.jpg', variations, replace=True, storage=storage
+        )
+        assert set(storage.files) == {
+            'img/image.jpg', 'img/image.medium.jpg', 'img/image.thumbnail.jpg',
+        }
+        storage.calls.clear()
+        assert StdImageFieldFile.render_all_variations(
+            'img/image.jpg', variations, replace=False, storage=storage
+        ) == []
+        assert storage.calls == {'exists': 2}
+
+    @pytest.mark.parametrize('max_size,rolled', [
+        (0, False), (5 * 1024 * 1024, False), (1, True),
+    ])
+    def test_save_variation__spooled(self, settings, max_size, rolled):
+        settings.STDIMAGE_SPOOL_MAX_SIZE = max_size
+        storage = MemoryStorage()
+        buffers = []
+        save = storage.save
+
+        def _save(name, content, max_length=None):
+            buffers.append(content.file)
+            return save(name, content, max_length)
+
+        storage.save = _save
+        for name, file_format in (('img/image.jpg', 'JPEG'), ('img/image.png', 'PNG')):
+            image = Image.new('RGB', (600, 400), (255, 55, 255))
+            StdImageFieldFile.save_variation(
+                name, image, {'format': file_format}, storage
+            )
+            with Image.open(storage.open(name)) as img:
+                assert img.size == (600, 400)
+                assert img.format == file_format
+        assert [buffer._rolled for buffer in buffers] == [rolled, rolled]
+
+    def test_render_variation(self, db):
+        instance = ResizeModel.objects.create(
+            image=self.fixtures['600x400.jpg']
+        )
+        instance.image.delete_variations()
+        variation_name = StdImageFieldFile.render_variation(
+            instance.image.name,
+            instance.image.field.variations['thumbnail'],
+            storage=instance.image.storage,
+        )
+        assert variation_name == 'img/600x400.thumbnail.jpg'
+        assert os.path.exists(os.path.join(IMG_DIR, '600x400.thumbnail.jpg'))
+        assert not os.path.exists(os.path.join(IMG_DIR, '600x400.medium.jpg'))
+
 
 class TestUtils(TestStdImage):
     """Tests Utils"""
@@ -262,3 +980,17 @@ class TestJPEGField(TestStdImage):
         assert obj.image.thumbnail.path.endswith('img/100.thumbnail.jpeg')
         assert obj.image.full.width == 100
         assert obj.image.full.height == 100
+
+    def test_variations_not_modified(self, db):
+        obj = models.JPEGModel.objects.create(image=self.fixtures['100.gif'])
+        assert obj.image.field.variations['full']['width'] is None
+        obj = models.JPEGModel.objects.create(image=self.fixtures['600x400.gif'])
+        assert obj.image.full.width == 600
+        assert obj.image.full.height == 400
+
+    def test_variation_size(self):
+        variations = models.JPEGModel._meta.get_field('image').variations
+        assert JPEGFieldFile.get_variation_size(
+            (600, 400), variations['full']) == (600, 400)
+        assert JPEGFieldFile.get_variation_size(
+            (50, 50), variations['thumbnail']) == (100, 75)
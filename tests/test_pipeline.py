@@ -0,0 +1,123 @@
+import io
+
+import pytest
+from PIL import Image
+
+from stdimage.manifest import read_manifest
+from stdimage.metrics import RenderStats
+from stdimage.models import StdImageField, StdImageFieldFile, VariationRenderError
+from stdimage.pipeline import RenderPipeline, RenderResult
+from stdimage.utils import render_variations_bulk
+from tests.models import ManifestModel, ThumbnailModel
+from tests.storage import MemoryStorage
+
+VARIATIONS = StdImageField(variations={
+    'thumbnail': (100, 75),
+    'medium': (400, 400),
+}).variations
+
+
+@pytest.fixture
+def storage():
+    storage = MemoryStorage()
+    for i in range(5):
+        with io.BytesIO() as f:
+            Image.new('RGB', (600, 400), (255, 55, 255)).save(f, 'JPEG')
+            storage.save('img/%d.jpg' % i, f)
+    storage.calls.clear()
+    return storage
+
+
+def get_pipeline(storage, **kwargs):
+    kwargs.setdefault('render_workers', 2)
+    return RenderPipeline(StdImageFieldFile, VARIATIONS, storage, **kwargs)
+
+
+class TestRenderPipeline:
+
+    def test_run(self, storage):
+        names = ['img/%d.jpg' % i for i in range(5)]
+        results = get_pipeline(storage, queue_size=1).run(iter(names))
+        assert sorted(results) == [
+            RenderResult(name, [
+                name.replace('.jpg', '.thumbnail.jpg'),
+                name.replace('.jpg', '.medium.jpg'),
+            ], None)
+            for name in names
+        ]
+        with Image.open(io.BytesIO(storage.files['img/0.medium.jpg'])) as img:
+            assert img.size == (400, 267)
+
+    def test_existing(self, storage):
+        get_pipeline(storage).run(['img/0.jpg'])
+        storage.calls.clear()
+        assert get_pipeline(storage).run(['img/0.jpg']) == [
+            RenderResult('img/0.jpg', [], None),
+        ]
+        assert storage.calls['open'] == 0
+        assert storage.calls['save'] == 0
+
+    def test_missing(self, storage):
+        results = get_pipeline(storage).run(['img/missing.jpg', 'img/0.jpg'])
+        results = {result.file_name: result for result in results}
+        assert results['img/missing.jpg'].error is not None
+        assert results['img/0.jpg'].error is None
+
+    def test_variation_error(self, storage, monkeypatch):
+        process_variation = StdImageFieldFile.process_variation.__func__
+
+        def _process_variation(cls, variation, image):
+            if variation['name'] == 'medium':
+                raise ValueError('medium')
+            return process_variation(cls, variation, image)
+
+        monkeypatch.setattr(StdImageFieldFile, 'process_variation',
+                            classmethod(_process_variation))
+        result, = get_pipeline(storage).run(['img/0.jpg'])
+        assert isinstance(result.error, VariationRenderError)
+        assert 'img/0.thumbnail.jpg' in storage.files
+        assert 'img/0.medium.jpg' not in storage.files
+
+    def test_manifest(self, storage):
+        get_pipeline(storage, manifest=True).run(['img/0.jpg'])
+        assert set(read_manifest(storage, 'img/0.jpg')) == {'thumbnail', 'medium'}
+
+    def test_do_render(self, storage):
+        result, = get_pipeline(storage, do_render=lambda **kwargs: False).run(
+            ['img/0.jpg']
+        )
+        assert result == RenderResult('img/0.jpg', [], None)
+        assert storage.calls['save'] == 0
+
+    def test_on_result_error(self, storage):
+        def on_result(result):
+            raise KeyError(result.file_name)
+
+        names = ['img/%d.jpg' % i for i in range(5)]
+        with pytest.raises(KeyError):
+            get_pipeline(storage, queue_size=1).run(names, on_result)
+
+    def test_stats(self, storage):
+        with RenderStats() as stats:
+            get_pipeline(storage).run(['img/0.jpg', 'img/1.jpg'])
+        summary = stats.summary()
+        assert summary['fetch']['count'] == 2
+        assert summary['decode']['count'] == 2
+        assert summary['store']['count'] == 4
+        assert summary['store']['bytes'] == summary['encode']['bytes']
+
+    def test_from_field(self):
+        field = ManifestModel._meta.get_field('image')
+        pipeline = RenderPipeline.from_field(field, replace=True, render_workers=3)
+        assert pipeline.field_class is field.attr_class
+        assert pipeline.variations is field.variations
+        assert pipeline.manifest is True
+        assert pipeline.queue_size == 6
+
+    def test_render_variations_bulk(self, db, image_upload_file):
+        obj = ThumbnailModel.objects.create(image=image_upload_file)
+        obj.image.delete_variations()
+        result, = render_variations_bulk(
+            ThumbnailModel.objects.all(), 'image', pipeline={'render_workers': 1},
+        )
+        assert result == RenderResult(obj.image.name, [obj.image.thumbnail.name], None)
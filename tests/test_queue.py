@@ -0,0 +1,137 @@
+import json
+import os
+import time
+
+import pytest
+from django.core.management import call_command
+
+from stdimage.files import get_private_dir
+from stdimage.queue import FileRenderQueue, RenderQueue, _get_storage, get_queue
+from tests.models import QueuedVariationsModel
+from tests.test_models import TestStdImage
+
+
+@pytest.fixture
+def queue_dir(settings, tmpdir):
+    settings.STDIMAGE_QUEUE_DIR = str(tmpdir)
+    return str(tmpdir)
+
+
+@pytest.mark.django_db
+class TestFileRenderQueue(TestStdImage):
+
+    def test_enqueue(self, queue_dir, image_upload_file):
+        obj = QueuedVariationsModel.objects.create(image=image_upload_file)
+        assert not os.path.exists(obj.image.thumbnail.path)
+        jobs = FileRenderQueue().pending()
+        assert len(jobs) == 1
+        assert jobs[0]['file_name'] == obj.image.name
+        assert jobs[0]['field_class'] == 'stdimage.models.StdImageFieldFile'
+
+    def test_enqueue__deduplicate(self, queue_dir, image_upload_file):
+        obj = QueuedVariationsModel.objects.create(image=image_upload_file)
+        obj.image.render_variations()
+        obj.image.render_variations()
+        assert len(FileRenderQueue().pending()) == 1
+
+    def test_work(self, queue_dir, image_upload_file):
+        obj = QueuedVariationsModel.objects.create(image=image_upload_file)
+        assert FileRenderQueue().work(burst=True) == 1
+        assert os.path.exists(obj.image.thumbnail.path)
+        assert not FileRenderQueue().pending()
+
+    def test_work__retry(self, queue_dir, image_upload_file):
+        obj = QueuedVariationsModel.objects.create(image=image_upload_file)
+        os.remove(obj.image.path)
+        queue = FileRenderQueue(backoff=60)
+        assert queue.work(burst=True) == 0
+        job, = queue.pending()
+        assert job['attempts'] == 1
+        assert job['not_before'] > 0
+        assert queue.claim() is None
+
+    def test_work__failed(self, queue_dir, image_upload_file):
+        obj = QueuedVariationsModel.objects.create(image=image_upload_file)
+        os.remove(obj.image.path)
+        queue = FileRenderQueue(max_attempts=2, backoff=0)
+        assert queue.work(burst=True) == 0
+        assert not queue.pending()
+        assert len(os.listdir(os.path.join(queue_dir, 'failed'))) == 1
+
+    def test_claim__running(self, queue_dir, image_upload_file):
+        obj = QueuedVariationsModel.objects.create(image=image_upload_file)
+        queue = FileRenderQueue()
+        job = queue.claim()
+        obj.image.render_variations()
+        assert queue.claim() is None
+        assert queue.process(job)
+        assert queue.work(burst=True) == 1
+        assert not os.listdir(os.path.join(queue_dir, 'running'))
+
+    def test_claim__timeout(self, queue_dir, image_upload_file):
+        QueuedVariationsModel.objects.create(image=image_upload_file)
+        queue = FileRenderQueue(backoff=0, timeout=60)
+        job = queue.claim()
+        running_path = os.path.join(queue_dir, 'running', '%s.json' % job['key'])
+        os.utime(running_path, (time.time() - 120,) * 2)
+        job = queue.claim()
+        assert job['attempts'] == 1
+        assert queue.process(job)
+        assert not os.listdir(os.path.join(queue_dir, 'running'))
+
+    def test_process__reclaimed(self, queue_dir, image_upload_file):
+        QueuedVariationsModel.objects.create(image=image_upload_file)
+        queue = FileRenderQueue(backoff=0, timeout=60)
+        job = queue.claim()
+        running_path = os.path.join(queue_dir, 'running', '%s.json' % job['key'])
+        os.utime(running_path, (time.time() - 120,) * 2)
+        reclaimed = queue.claim()
+        assert queue.process(job)
+        assert os.listdir(os.path.join(queue_dir, 'running'))
+        assert queue.process(reclaimed)
+        assert not os.listdir(os.path.join(queue_dir, 'running'))
+
+    def test_run__field_class(self, queue_dir, image_upload_file):
+        QueuedVariationsModel.objects.create(image=image_upload_file)
+        job, = FileRenderQueue().pending()
+        with pytest.raises(ValueError):
+            RenderQueue.run(dict(job, field_class='os.system'))
+
+    def test_default_path(self, monkeypatch, tmpdir, settings):
+        monkeypatch.setattr('tempfile.gettempdir', lambda: str(tmpdir))
+        settings.STDIMAGE_QUEUE_DIR = None
+        assert FileRenderQueue().path == get_private_dir('stdimage-queue')
+
+    def test_command(self, queue_dir, image_upload_file):
+        obj = QueuedVariationsModel.objects.create(image=image_upload_file)
+        call_command('renderqueue', '--burst')
+        assert os.path.exists(obj.image.thumbnail.path)
+
+
+class TestRenderQueue:
+    def test_put(self):
+        with pytest.raises(NotImplementedError):
+            RenderQueue().put({})
+
+
+class TestGetStorage:
+    def test_storage(self):
+        storage = _get_storage('tests.storage.MemoryStorage', json.dumps([[], {}]))
+        assert storage.__class__.__name__ == 'MemoryStorage'
+
+    def test_not_a_storage(self):
+        with pytest.raises(ValueError):
+            _get_storage('os.system', json.dumps([['true'], {}]))
+
+
+class TestGetQueue:
+    def test_default(self):
+        assert isinstance(get_queue(), FileRenderQueue)
+
+    def test_setting(self, settings):
+        settings.STDIMAGE_RENDER_QUEUE = 'stdimage.queue.RenderQueue'
+        assert type(get_queue()) is RenderQueue
+
+    def test_instance(self):
+        queue = FileRenderQueue()
+        assert get_queue(queue) is queue
@@ -0,0 +1,150 @@
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.utils.encoding import filepath_to_uri
+
+from stdimage.storage import delete_files, existing_files, get_url_prefix, get_urls
+
+from .storage import MemoryStorage
+
+
+class BulkMemoryStorage(MemoryStorage):
+
+    def exists_many(self, names):
+        self.calls['exists_many'] += 1
+        return [name for name in names if name in self.files]
+
+    def delete_many(self, names):
+        self.calls['delete_many'] += 1
+        for name in names:
+            self.files.pop(name, None)
+
+
+class QuotingMemoryStorage(MemoryStorage):
+
+    def url(self, name):
+        self.calls['url'] += 1
+        return 'https://example.com/media/%s' % filepath_to_uri(name)
+
+
+class SignedMemoryStorage(MemoryStorage):
+
+    def url(self, name):
+        self.calls['url'] += 1
+        return 'https://example.com/%s?signature=%d' % (name, self.calls['url'])
+
+
+class BatchUrlMemoryStorage(MemoryStorage):
+
+    def url_many(self, names):
+        self.calls['url_many'] += 1
+        return ['https://example.com/%s?signature=1' % name for name in names]
+
+
+class TestExistingFiles:
+    def test_exists(self):
+        storage = MemoryStorage()
+        storage.save('img/a.jpg', ContentFile(b'a'))
+        storage.calls.clear()
+        assert existing_files(storage, ['img/a.jpg', 'img/b.jpg']) == {'img/a.jpg'}
+        assert storage.calls == {'exists': 2}
+
+    def test_listdir(self, settings):
+        settings.STDIMAGE_EXISTS_LISTDIR = True
+        storage = MemoryStorage()
+        storage.save('img/a.jpg', ContentFile(b'a'))
+        storage.save('img/b.jpg', ContentFile(b'b'))
+        storage.save('other/c.jpg', ContentFile(b'c'))
+        storage.calls.clear()
+        assert existing_files(
+            storage, ['img/a.jpg', 'img/b.jpg', 'img/c.jpg', 'other/c.jpg']
+        ) == {'img/a.jpg', 'img/b.jpg', 'other/c.jpg'}
+        assert storage.calls['listdir'] == 2
+        assert storage.calls['exists'] == 0
+
+    def test_listdir__not_implemented(self, settings, monkeypatch):
+        settings.STDIMAGE_EXISTS_LISTDIR = True
+        storage = MemoryStorage()
+        storage.save('img/a.jpg', ContentFile(b'a'))
+        storage.calls.clear()
+
+        def listdir(path):
+            raise NotImplementedError
+
+        monkeypatch.setattr(storage, 'listdir', listdir)
+        assert existing_files(storage, ['img/a.jpg', 'img/b.jpg']) == {'img/a.jpg'}
+        assert storage.calls['exists'] == 2
+
+    def test_exists_many(self):
+        storage = BulkMemoryStorage()
+        storage.save('img/a.jpg', ContentFile(b'a'))
+        assert existing_files(storage, ['img/a.jpg', 'img/b.jpg']) == {'img/a.jpg'}
+        assert storage.calls['exists_many'] == 1
+        assert storage.calls['listdir'] == 0
+
+    def test_file_system_storage(self, tmpdir):
+        storage = FileSystemStorage(location=str(tmpdir))
+        storage.save('img/a.jpg', ContentFile(b'a'))
+        assert existing_files(storage, ['img/a.jpg', 'img/b.jpg']) == {'img/a.jpg'}
+
+    def test_empty(self):
+        storage = MemoryStorage()
+        assert existing_files(storage, []) == set()
+        assert not storage.calls
+
+
+class TestDeleteFiles:
+    def test_delete(self):
+        storage = MemoryStorage()
+        storage.save('img/a.jpg', ContentFile(b'a'))
+        storage.save('img/b.jpg', ContentFile(b'b'))
+        delete_files(storage, ['img/a.jpg', 'img/b.jpg'])
+        assert not storage.files
+        assert storage.calls['delete'] == 2
+
+    def test_delete_many(self):
+        storage = BulkMemoryStorage()
+        storage.save('img/a.jpg', ContentFile(b'a'))
+        storage.save('img/b.jpg', ContentFile(b'b'))
+        delete_files(storage, ['img/a.jpg', 'img/b.jpg'])
+        assert not storage.files
+        assert storage.calls['delete_many'] == 1
+        assert storage.calls['delete'] == 0
+
+
+class TestGetUrls:
+    def test_prefix(self):
+        storage = QuotingMemoryStorage()
+        assert get_url_prefix(storage) == 'https://example.com/media/'
+        assert get_urls(storage, ['img/a b.jpg', 'img/c.jpg']) == [
+            'https://example.com/media/img/a%20b.jpg',
+            'https://example.com/media/img/c.jpg',
+        ]
+        get_urls(storage, ['img/d.jpg'])
+        assert storage.calls['url'] == 2
+
+    def test_signed(self):
+        storage = SignedMemoryStorage()
+        assert get_url_prefix(storage) is None
+        assert get_urls(storage, ['img/a.jpg']) == [
+            'https://example.com/img/a.jpg?signature=3',
+        ]
+
+    def test_unquoted(self):
+        storage = MemoryStorage()
+        assert get_url_prefix(storage) is None
+        assert get_urls(storage, ['img/a b.jpg']) == ['https://example.com/img/a b.jpg']
+
+    def test_url_many(self):
+        storage = BatchUrlMemoryStorage()
+        assert get_urls(storage, ['img/a.jpg', 'img/b.jpg']) == [
+            'https://example.com/img/a.jpg?signature=1',
+            'https://example.com/img/b.jpg?signature=1',
+        ]
+        assert storage.calls == {'url_many': 1}
+
+    def test_file_system_storage(self, tmpdir):
+        storage = FileSystemStorage(location=str(tmpdir), base_url='/media/')
+        assert get_urls(storage, ['img/\u00e4.jpg']) == [storage.url('img/\u00e4.jpg')]
+
+    def test_empty(self):
+        assert get_urls(MemoryStorage(), []) == []
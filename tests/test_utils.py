@@ -1,10 +1,15 @@
+import asyncio
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 import pytest
 from PIL import Image
 
-from stdimage.utils import render_variations
-from tests.models import ManualVariationsModel
+from stdimage.metrics import RenderStats
+from stdimage.utils import (RenderResult, arender_variations, render_file,
+                            render_variations, render_variations_bulk,)
+from tests.models import ManualVariationsModel, ThumbnailModel
 from tests.test_models import IMG_DIR
 
 
@@ -29,3 +34,107 @@ class TestRenderVariations:
             }
         )
         assert os.path.exists(path)
+
+    def test_arender_variations(self, image_upload_file):
+        instance = ManualVariationsModel.customer_manager.create(
+            image=image_upload_file
+        )
+        path = instance.image.storage.path(
+            instance.image.get_variation_name(instance.image.name, 'thumbnail')
+        )
+        assert not os.path.exists(path)
+        asyncio.run(arender_variations(
+            file_name=instance.image.name,
+            variations=instance.image.field.variations,
+        ))
+        assert os.path.exists(path)
+
+
+@pytest.mark.django_db
+class TestRenderVariationsBulk:
+    @pytest.mark.parametrize('executor', ['inline', 'thread'])
+    def test_queryset(self, image_upload_file, executor):
+        objs = [ThumbnailModel.objects.create(image=image_upload_file)
+                for _ in range(3)]
+        for obj in objs:
+            obj.image.delete_variations()
+        ThumbnailModel.objects.create()
+        results = render_variations_bulk(
+            ThumbnailModel.objects.all(), 'image', executor=executor, max_pending=2,
+        )
+        assert sorted(result.file_name for result in results) == sorted(
+            obj.image.name for obj in objs
+        )
+        assert all(result.error is None for result in results)
+        assert all(os.path.exists(obj.image.thumbnail.path) for obj in objs)
+
+    def test_process_pool(self, image_upload_file):
+        obj = ThumbnailModel.objects.create(image=image_upload_file)
+        obj.image.delete_variations()
+        field = ThumbnailModel._meta.get_field('image')
+        with ProcessPoolExecutor(1) as executor:
+            results = render_variations_bulk(
+                [obj.image.name], field, executor=executor,
+            )
+        assert results == [
+            RenderResult(obj.image.name, [obj.image.thumbnail.name], None)
+        ]
+        assert os.path.exists(obj.image.thumbnail.path)
+
+    def test_queue_setting(self, image_upload_file, settings):
+        settings.STDIMAGE_RENDER_EXECUTOR = 'queue'
+        obj = ThumbnailModel.objects.create(image=image_upload_file)
+        obj.image.delete_variations()
+        field = ThumbnailModel._meta.get_field('image')
+        results = render_variations_bulk([obj.image.name], field)
+        assert results == [
+            RenderResult(obj.image.name, [obj.image.thumbnail.name], None)
+        ]
+        assert os.path.exists(obj.image.thumbnail.path)
+
+    def test_queue(self):
+        field = ThumbnailModel._meta.get_field('image')
+        with pytest.raises(ValueError) as e:
+            render_variations_bulk(['img/test.jpg'], field, executor='queue')
+        assert 'Render queues do not report results' in str(e.value)
+
+    def test_render_file__deconstructed_storage(self, image_upload_file):
+        obj = ThumbnailModel.objects.create(image=image_upload_file)
+        obj.image.delete_variations()
+        field = ThumbnailModel._meta.get_field('image')
+        path, args, kwargs = field.storage.deconstruct()
+        result, stats = render_file(
+            obj.image.name, field.attr_class, field.variations, False,
+            (path, json.dumps([args, kwargs], default=str)), True,
+        )
+        assert result == RenderResult(obj.image.name, [obj.image.thumbnail.name], None)
+        assert stats is None
+        assert os.path.exists(obj.image.thumbnail.path)
+
+    def test_names(self, image_upload_file):
+        obj = ThumbnailModel.objects.create(image=image_upload_file)
+        field = ThumbnailModel._meta.get_field('image')
+        reported = []
+        results = render_variations_bulk(
+            [obj.image.name, 'img/missing.jpg'], field, on_result=reported.append,
+        )
+        assert results == reported
+        assert results[0] == RenderResult(obj.image.name, [], None)
+        assert results[1].file_name == 'img/missing.jpg'
+        assert isinstance(results[1].error, FileNotFoundError)
+
+    def test_replace(self, image_upload_file):
+        obj = ThumbnailModel.objects.create(image=image_upload_file)
+        field = ThumbnailModel._meta.get_field('image')
+        results = render_variations_bulk([obj.image.name], field, replace=True)
+        assert results[0].variations == [obj.image.thumbnail.name]
+
+    def test_stats(self, image_upload_file):
+        objs = [ThumbnailModel.objects.create(image=image_upload_file)
+                for _ in range(2)]
+        stats = RenderStats()
+        render_variations_bulk(
+            [obj.image.name for obj in objs], ThumbnailModel._meta.get_field('image'),
+            replace=True, executor='thread', stats=stats,
+        )
+        assert stats.summary()['decode']['count'] == 2
@@ -1,4 +1,10 @@
+import io
+
+import pytest
+from PIL import Image
+
 from stdimage import validators
+from tests.models import SimpleModel
 
 
 class TestBaseSizeValidator:
@@ -58,3 +64,47 @@ class TestMinSizeValidator:
         assert instance.compare((150, 100), (300, 200))
         assert instance.compare((300, 100), (300, 200))
         assert instance.compare((150, 200), (300, 200))
+
+
+class CountingFile(io.BytesIO):
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class TestBaseSizeValidatorClean:
+    @pytest.fixture
+    def image_file(self):
+        f = CountingFile()
+        img = Image.effect_noise((800, 600), 100).convert('RGB')
+        img.save(f, 'PNG')
+        f.seek(0)
+        return f
+
+    def test_clean(self, image_file):
+        assert validators.BaseSizeValidator.clean(image_file) == (800, 600)
+        assert image_file.bytes_read < len(image_file.getvalue()) / 10
+        assert image_file.tell() == 0
+
+    def test_clean__cached(self, image_file):
+        validators.MinSizeValidator(100, 100)(image_file)
+        bytes_read = image_file.bytes_read
+        validators.MaxSizeValidator(1000, 1000)(image_file)
+        assert image_file.bytes_read == bytes_read
+        assert image_file._dimensions_cache == (800, 600)
+
+    def test_clean__form_image(self, image_file):
+        image_file.image = Image.new('RGB', (300, 200))
+        assert validators.BaseSizeValidator.clean(image_file) == (300, 200)
+        assert image_file.bytes_read == 0
+
+    @pytest.mark.django_db
+    def test_clean__image_field_file(self, image_upload_file):
+        instance = SimpleModel.objects.create(image=image_upload_file)
+        instance = SimpleModel.objects.get(pk=instance.pk)
+        assert validators.BaseSizeValidator.clean(instance.image) == (250, 250)
+        assert instance.image._dimensions_cache == (250, 250)
+        assert instance.image.width == 250